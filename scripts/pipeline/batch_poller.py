@@ -0,0 +1,257 @@
+"""
+Multiplexed poller for provider batch jobs.
+
+Tracks every outstanding job in one place and polls each provider once per round, using its list
+endpoint when several jobs are due. Intervals adapt per job: from its reported progress when the
+provider exposes request counts, otherwise from completion times observed for earlier jobs, and
+otherwise by backing off geometrically from MIN_POLL_INTERVAL.
+"""
+
+import time
+from statistics import median
+from collections import defaultdict
+
+from shared_utils import log_and_print, shutdown_requested, wait_or_shutdown
+
+MIN_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 120
+BACKOFF_FACTOR = 1.5
+STATUS_LOG_INTERVAL = 60
+SUBMIT_RETRY_DELAY = 60    # seconds before resubmitting a batch rejected while nothing else is in flight
+MAX_SUBMIT_RETRIES = 5
+
+
+class BatchPoller:
+    """Poll batch jobs across providers, waking only when the next job is due."""
+
+    def __init__(self, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.providers = {}
+        self.jobs = {}
+        self.durations = defaultdict(list)
+
+    def register_provider(self, provider, poll_jobs):
+        """poll_jobs(jobs) refreshes a list of job dicts in place and returns {job_id: status}.
+
+        Status is 'running', 'done' or 'requeue'; a job may set job['progress'] = (done, total).
+        """
+        self.providers[provider] = poll_jobs
+
+    def add(self, provider, job, context=None, num_requests=0):
+        """Track a job of num_requests requests; `context` is handed back with its final status."""
+        started_at = job.get('submitted_at', time.time())
+        self.jobs[(provider, job['id'])] = {
+            'provider': provider,
+            'job': job,
+            'context': context,
+            'num_requests': num_requests,
+            'started_at': started_at,
+            'polls': 0,
+            'next_poll_at': time.time() + self.min_interval,
+        }
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def active(self, provider):
+        """Number of tracked jobs for one provider."""
+        return sum(1 for tracked in self.jobs.values() if tracked['provider'] == provider)
+
+    def active_requests(self, provider):
+        """Number of requests in the tracked jobs of one provider."""
+        return sum(tracked['num_requests'] for tracked in self.jobs.values() if tracked['provider'] == provider)
+
+    def wait_for_updates(self):
+        """Sleep until a job is due, poll every due provider, and return finished jobs.
+
+        Returns a list of (provider, job, status, context) for jobs that left 'running' (they are no
+        longer tracked), or None if shutdown was requested while waiting.
+        """
+        if not self.jobs:
+            return []
+
+        next_due = min(tracked['next_poll_at'] for tracked in self.jobs.values())
+        if wait_or_shutdown(max(0.0, next_due - time.time())):
+            return None
+
+        now = time.time()
+        due_providers = {tracked['provider'] for tracked in self.jobs.values() if tracked['next_poll_at'] <= now}
+
+        finished = []
+        for provider in due_providers:
+            # Providers list jobs in bulk, so a round refreshes every job of a due provider at the same cost.
+            tracked_jobs = [tracked for tracked in self.jobs.values() if tracked['provider'] == provider]
+            statuses = self.providers[provider]([tracked['job'] for tracked in tracked_jobs])
+
+            now = time.time()
+            for tracked in tracked_jobs:
+                job = tracked['job']
+                tracked['polls'] += 1
+                status = statuses.get(job['id'], 'running')
+                if status == 'running':
+                    tracked['next_poll_at'] = now + self._next_interval(tracked, now)
+                    continue
+
+                del self.jobs[(provider, job['id'])]
+                if status == 'done':
+                    self.durations[provider].append(now - tracked['started_at'])
+                finished.append((provider, job, status, tracked['context']))
+
+        return finished
+
+    def _next_interval(self, tracked, now):
+        elapsed = now - tracked['started_at']
+        done, total = tracked['job'].get('progress') or (0, 0)
+
+        if total and 0 < done < total:
+            remaining = elapsed * (total - done) / done
+        elif self.durations[tracked['provider']]:
+            remaining = median(self.durations[tracked['provider']]) - elapsed
+        else:
+            return min(self.max_interval, self.min_interval * BACKOFF_FACTOR ** tracked['polls'])
+
+        # Poll at half the estimated remaining time; once overdue, back off with the job's age.
+        interval = remaining / 2 if remaining > 0 else elapsed / 20
+        return max(self.min_interval, min(self.max_interval, interval))
+
+
+class BatchLane:
+    """One provider's queue of batches and the callbacks that submit, poll, collect and record them.
+
+    `batches` is a list of (batch_num, qa_pairs). submit(batch_num, qa_pairs) returns a job dict with an 'id',
+    None if submission failed, or 'requeue' if the provider rejected it for a rate or queue limit; poll_jobs(jobs)
+    is registered with the BatchPoller; collect(batch_num, job, qa_pairs) reads and writes out a finished job (job
+    is None after a failed submission) and returns (results, token_usage), which are passed on as
+    on_complete(batch_num, qa_pairs, results, token_usage). If collect raises (e.g. the results download drops),
+    nothing of the job is written and it stays 'submitted' in the ledger, to be reattached and downloaded again
+    on the next run. Every created job is recorded in the ledger before it is polled; `reattached` lists
+    (batch_num, qa_pairs, job) already running at the provider. At most max_active jobs, and unless None at
+    most max_requests requests, are in flight at once.
+    """
+
+    def __init__(self, provider, batches, submit, poll_jobs, collect, on_complete, max_active, ledger, output_dir,
+                 logger, reattached=(), max_requests=None):
+        self.provider = provider
+        self.queued = list(batches)
+        self.submit = submit
+        self.poll_jobs = poll_jobs
+        self.collect = collect
+        self.on_complete = on_complete
+        self.max_active = max_active
+        self.max_requests = max_requests
+        self.rejections = 0
+        self.ledger = ledger
+        self.output_dir = output_dir
+        self.logger = logger
+        self.reattached = list(reattached)
+        self.completed = 0
+
+
+def submit_queued(lane, poller):
+    """Submit queued batches of one lane until it has max_active jobs or max_requests requests in flight.
+
+    A batch the provider rejects for a rate or queue limit goes back to the front of the queue: it waits for an
+    in-flight batch to finish, or, with nothing in flight, is retried after SUBMIT_RETRY_DELAY and failed after
+    MAX_SUBMIT_RETRIES rejections in a row.
+    """
+    while lane.queued and poller.active(lane.provider) < lane.max_active and not shutdown_requested():
+        batch_num, qa_pairs = lane.queued[0]
+        in_flight = poller.active_requests(lane.provider)
+        if lane.max_requests and in_flight and in_flight + len(qa_pairs) > lane.max_requests:
+            break
+        lane.queued.pop(0)
+        log_and_print(lane.logger, f"\n--- Submitting batch {batch_num} ({len(qa_pairs)} pairs, "
+                                   f"{poller.active(lane.provider)} active, {len(lane.queued)} queued) ---")
+        job = lane.submit(batch_num, qa_pairs)
+        if job == 'requeue' and poller.active(lane.provider):
+            lane.queued.insert(0, (batch_num, qa_pairs))
+            lane.max_active = max(1, poller.active(lane.provider))
+            log_and_print(lane.logger, f"  Rejected by provider rate limit; requeued, now keeping {lane.max_active} "
+                                       f"batch(es) in flight")
+            break
+        if job == 'requeue':
+            lane.rejections += 1
+            if lane.rejections <= MAX_SUBMIT_RETRIES:
+                lane.queued.insert(0, (batch_num, qa_pairs))
+                log_and_print(lane.logger, f"  Rejected by provider rate limit with nothing in flight; retrying in "
+                                           f"{SUBMIT_RETRY_DELAY * lane.rejections}s")
+                wait_or_shutdown(SUBMIT_RETRY_DELAY * lane.rejections)
+                continue
+            log_and_print(lane.logger, f"  Rejected {lane.rejections} times in a row; giving up on batch {batch_num}")
+            job = None
+        lane.rejections = 0
+        if job is None:
+            results, token_usage = lane.collect(batch_num, None, qa_pairs)
+            lane.on_complete(batch_num, qa_pairs, results, token_usage)
+            lane.completed += 1
+            continue
+        lane.ledger.record(job['id'], batch_num, qa_pairs, lane.output_dir)
+        poller.add(lane.provider, job, (lane, batch_num, qa_pairs), len(qa_pairs))
+
+
+def run_concurrent_batches(lanes):
+    """Keep up to max_active batches in flight per lane and hand each one to its on_complete as it finishes.
+
+    All lanes share one BatchPoller, so several judges running in one process poll their providers in the
+    same rounds. Returns False if stopped by shutdown.
+    """
+    poller = BatchPoller()
+    for lane in lanes:
+        poller.register_provider(lane.provider, lane.poll_jobs)
+        for batch_num, qa_pairs, job in lane.reattached:
+            poller.add(lane.provider, job, (lane, batch_num, qa_pairs), len(qa_pairs))
+
+    last_status_log = time.time()
+
+    while any(lane.queued for lane in lanes) or len(poller):
+        for lane in lanes:
+            submit_queued(lane, poller)
+
+        if shutdown_requested() and not len(poller):
+            break
+
+        finished = poller.wait_for_updates()
+        if finished is None:
+            for lane in lanes:
+                log_and_print(lane.logger, f"\nShutdown requested with {poller.active(lane.provider)} batch(es) in "
+                                           f"flight and {len(lane.queued)} not yet submitted; in-flight batches stay "
+                                           f"in {lane.ledger.path}")
+            return False
+
+        for provider, job, status, (lane, batch_num, qa_pairs) in finished:
+            if status == 'requeue' and poller.active(provider):
+                # The provider queue is full; resubmit once an in-flight batch frees capacity.
+                lane.max_active = max(1, poller.active(provider))
+                lane.ledger.update(job['id'], 'rejected')
+                lane.queued.insert(0, (batch_num, qa_pairs))
+                log_and_print(lane.logger, f"\nBatch {batch_num} rejected by provider queue limit; "
+                                           f"requeued, now keeping {lane.max_active} batch(es) in flight")
+                continue
+            if status == 'requeue' and len(qa_pairs) > 1:
+                # Too large for the provider queue even on its own; resubmit it as two halves.
+                half = len(qa_pairs) // 2
+                lane.ledger.update(job['id'], 'rejected')
+                lane.queued[:0] = [(batch_num, qa_pairs[:half]), (batch_num, qa_pairs[half:])]
+                log_and_print(lane.logger, f"\nBatch {batch_num} exceeds the provider queue limit on its own; "
+                                           f"split into batches of {half} and {len(qa_pairs) - half} pairs")
+                continue
+
+            log_and_print(lane.logger, f"\n--- Batch {batch_num} finished ({job['id']}) ---")
+            try:
+                results, token_usage = lane.collect(batch_num, job, qa_pairs)
+            except Exception as e:
+                log_and_print(lane.logger, f"  ERROR: Collecting {job['id']} failed: {e}; it stays submitted in "
+                                           f"{lane.ledger.path} and its results are downloaded on the next run")
+                continue
+            lane.on_complete(batch_num, qa_pairs, results, token_usage)
+            lane.ledger.update(job['id'], 'collected')
+            lane.completed += 1
+
+        if time.time() - last_status_log >= STATUS_LOG_INTERVAL:
+            last_status_log = time.time()
+            for lane in lanes:
+                log_and_print(lane.logger, f"  Batches: {poller.active(lane.provider)} in flight, "
+                                           f"{len(lane.queued)} queued, {lane.completed} completed")
+
+    return not shutdown_requested()
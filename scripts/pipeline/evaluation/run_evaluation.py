@@ -5,17 +5,21 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import os
 import sys
 import argparse
-import pandas as pd
-import numpy as np
-from scipy import stats
-from evaluate import load as load_metric
-from shared_utils import setup_logger, log_and_print, read_csv_as_dicts, write_csv_from_dicts
+from math import comb
+from collections import Counter
+from registry import load_metric
+from shared_utils import (setup_logger, log_and_print, read_csv_as_dicts, write_csv_from_dicts, sample_suffix,
+                          answer_columns, CASCADE_MARKER)
 
 COMPUTE_BERTSCORE = False
 COMPUTE_ROUGEL = False
 COMPUTE_ENSEMBLE = True
+COMPUTE_SAMPLES = True
 INCREMENTAL_WRITE = True
 
+JUDGE_COLUMNS = ['Claude_Judge_Rating', 'Gemini_Judge_Rating', 'Openai_Judge_Rating', 'Gpt4o_Judge_Rating',
+                 'Local_Judge_Rating']
+
 
 def get_log_file(csv_path):
     """Get log file path based on input CSV name."""
@@ -80,9 +84,9 @@ def compute_metrics(data, logger, csv_file):
     bertscore = None
     rouge = None
     if COMPUTE_BERTSCORE:
-        bertscore = load_metric("bertscore")
+        bertscore = load_metric("BERTScore F1")
     if COMPUTE_ROUGEL:
-        rouge = load_metric("rouge")
+        rouge = load_metric("ROUGEL")
 
     BATCH_SIZE = 1000
     for batch_start in range(0, len(rows_to_compute), BATCH_SIZE):
@@ -118,16 +122,15 @@ def compute_metrics(data, logger, csv_file):
 
 
 def majority_vote(ratings):
-    """Return most common rating across judges, ties go to higher rating."""
+    """Return most common rating across judges, ties go to the lower rating (as scipy.stats.mode)."""
     valid_ratings = [r for r in ratings if r not in [-1, '-1', '']]
 
     if len(valid_ratings) == 0:
         return -1
 
-    valid_ratings = [int(float(r)) for r in valid_ratings]
-
-    mode_result = stats.mode(valid_ratings, keepdims=True)
-    return int(mode_result.mode[0])
+    counts = Counter(int(float(r)) for r in valid_ratings)
+    top_count = max(counts.values())
+    return min(rating for rating, count in counts.items() if count == top_count)
 
 
 def add_ensemble_judge(data, logger):
@@ -138,26 +141,122 @@ def add_ensemble_judge(data, logger):
         log_and_print(logger, "Ensemble judge disabled via toggle variable")
         return list(data[0].keys())
 
-    judge_cols = []
-    for judge in ['Claude_Judge_Rating', 'Gemini_Judge_Rating', 'Openai_Judge_Rating', 'Gpt4o_Judge_Rating']:
-        if judge in data[0]:
-            judge_cols.append(judge)
+    fieldnames = list(data[0].keys())
 
-    log_and_print(logger, f"Found {len(judge_cols)} judge columns: {', '.join(judge_cols)}")
+    for sample_index in range(1, count_samples(fieldnames) + 1):
+        suffix = sample_suffix(sample_index)
+        judge_cols = []
+        for judge in JUDGE_COLUMNS:
+            if judge + suffix in data[0]:
+                judge_cols.append(judge + suffix)
+
+        log_and_print(logger, f"Found {len(judge_cols)} judge columns: {', '.join(judge_cols)}")
+
+        if len(judge_cols) < 2:
+            log_and_print(logger, "Warning: Need at least 2 judges for ensemble voting. Skipping.")
+            continue
+
+        ensemble_col = 'Ensemble_Judge_Rating' + suffix
+        if ensemble_col not in fieldnames:
+            fieldnames.append(ensemble_col)
+
+        for row in data:
+            ratings = [row.get(col, '') for col in judge_cols]
+            row[ensemble_col] = majority_vote(ratings)
+
+        log_and_print(logger, f"Ensemble judge added: {ensemble_col}")
+
+    return fieldnames
+
+
+
+def count_samples(fieldnames):
+    """Number of self-consistency samples stored as answer columns (1 when there are none)."""
+    num_samples = 1
+    while f"Model Answer{sample_suffix(num_samples + 1)}" in fieldnames:
+        num_samples += 1
+    return num_samples
+
+
+def normalize_sample_answer(answer):
+    """Normalize an answer for voting: case, whitespace and trailing period."""
+    return ' '.join(answer.lower().split()).rstrip('.')
+
+
+def pass_at_k(num_correct, n, k):
+    """Unbiased pass@k estimate 1 - C(n-c, k) / C(n, k), vectorized over an array of correct counts c."""
+    import numpy as np
+
+    table = np.array([1.0 - comb(n - c, k) / comb(n, k) for c in range(n + 1)])
+    return table[num_correct]
 
-    if len(judge_cols) < 2:
-        log_and_print(logger, "Warning: Need at least 2 judges for ensemble voting. Skipping.")
-        return list(data[0].keys())
+
+def compute_sample_consistency(data, logger, pass_ks=None):
+    """Add majority-of-samples ratings and report pass@k over self-consistency samples."""
+    log_and_print(logger, "\n--- Self-Consistency Samples ---")
 
     fieldnames = list(data[0].keys())
-    if 'Ensemble_Judge_Rating' not in fieldnames:
-        fieldnames.append('Ensemble_Judge_Rating')
+    num_samples = count_samples(fieldnames)
+
+    if not COMPUTE_SAMPLES or num_samples < 2:
+        log_and_print(logger, "No sample columns found (or disabled via toggle variable)")
+        return fieldnames
+
+    log_and_print(logger, f"Found {num_samples} samples per question")
+
+    import numpy as np
+    import pandas as pd
 
-    for row in data:
-        ratings = [row.get(col, '') for col in judge_cols]
-        row['Ensemble_Judge_Rating'] = majority_vote(ratings)
+    df = pd.DataFrame(data)
+    answers = df[answer_columns(num_samples)].fillna('').astype(str)
+    normalized = answers.apply(lambda col: col.map(normalize_sample_answer)).to_numpy()
+    answered = (normalized != '').all(axis=1)
+
+    codes, _ = pd.factorize(normalized.ravel())
+    codes = codes.reshape(normalized.shape)
+    votes = (codes[:, :, None] == codes[:, None, :]).sum(axis=2)
+    majority_idx = votes.argmax(axis=1)
+    agreement = votes.max(axis=1) / num_samples
+
+    if 'Sample_Agreement' not in fieldnames:
+        fieldnames.append('Sample_Agreement')
+    for row, is_answered, value in zip(data, answered, agreement):
+        row['Sample_Agreement'] = f"{value:.3f}" if is_answered else ''
+
+    log_and_print(logger, f"Mean answer agreement: {agreement[answered].mean():.1%} (N={int(answered.sum()):,})")
+
+    rating_cols = [f"Ensemble_Judge_Rating{sample_suffix(i)}" for i in range(1, num_samples + 1)]
+    missing_cols = [col for col in rating_cols if col not in df.columns]
+    if missing_cols:
+        log_and_print(logger, f"Missing per-sample ratings ({', '.join(missing_cols)}); judge and merge each sample first")
+        return fieldnames
+
+    ratings = df[rating_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    ratings = np.where(ratings >= 1, ratings, np.nan)
+    complete = answered & ~np.isnan(ratings).any(axis=1)
+    correct = ratings >= 3
+    num_correct = correct.sum(axis=1)
+    majority_rating = ratings[np.arange(len(df)), majority_idx]
+
+    if 'Majority_Sample_Rating' not in fieldnames:
+        fieldnames.append('Majority_Sample_Rating')
+    for row, is_complete, rating in zip(data, complete, majority_rating):
+        row['Majority_Sample_Rating'] = int(rating) if is_complete else -1
+
+    pass_ks = sorted(k for k in set(pass_ks or [1, num_samples]) if 1 <= k <= num_samples)
+    groups = {
+        'TEACHER': (df['QA Type'] == 'teacher').to_numpy(),
+        'SYNTHETIC (Claude+GPT4o)': df['QA Type'].isin(['claude', 'gpt4o']).to_numpy(),
+    }
+    for label, mask in groups.items():
+        mask = mask & complete
+        if not mask.any():
+            continue
+        log_and_print(logger, f"  {label} (N={int(mask.sum()):,}):")
+        log_and_print(logger, f"    Majority-of-samples Accuracy: {(majority_rating[mask] >= 3).mean():.1%}")
+        for k in pass_ks:
+            log_and_print(logger, f"    pass@{k}: {pass_at_k(num_correct[mask], num_samples, k).mean():.1%}")
 
-    log_and_print(logger, "Ensemble judge added")
     return fieldnames
 
 
@@ -168,7 +267,7 @@ def compute_accuracy(ratings):
     if len(ratings) == 0:
         return 0.0, 0
     binarized = [1 if r >= 3 else 0 for r in ratings]
-    return np.mean(binarized), len(ratings)
+    return sum(binarized) / len(binarized), len(ratings)
 
 
 def get_rating_distribution(ratings):
@@ -187,12 +286,27 @@ def get_rating_distribution(ratings):
     return rating_dist, binary_dist
 
 
-def compute_benchmark_scores(data, logger):
-    """Calculate and print final accuracy scores by QA type and judge."""
+def cascade_judge_columns(csv_path):
+    """Rating columns of judges that only rated the disagreements of a cascade, from run_cascade's markers."""
+    model_name = os.path.basename(csv_path).replace('.csv', '')
+    return {
+        judge_col for judge_col in JUDGE_COLUMNS
+        if os.path.exists(f"../../../output/{judge_col.replace('_Judge_Rating', '').lower()}_judge/{model_name}/"
+                          f"{CASCADE_MARKER}")
+    }
+
+
+def compute_benchmark_scores(data, logger, cascade_columns=()):
+    """Calculate and print final accuracy scores by QA type and judge.
+
+    Judges in cascade_columns only rated the hard pairs of a cascade; their own scores are skipped.
+    """
     log_and_print(logger, "\n" + "="*80)
     log_and_print(logger, "BENCHMARK SCORES (Binarized: 1-2→0, 3-4→1)")
     log_and_print(logger, "="*80)
 
+    import pandas as pd
+
     df = pd.DataFrame(data)
 
     def print_scores(judge_name, ratings, qa_type_label):
@@ -228,13 +342,19 @@ def compute_benchmark_scores(data, logger):
                 ratings = subset['Ensemble_Judge_Rating'].tolist()
                 print_scores("Ensemble", ratings, qa_type.upper())
 
-    for judge_col in ['Claude_Judge_Rating', 'Gemini_Judge_Rating', 'Openai_Judge_Rating', 'Gpt4o_Judge_Rating']:
+    for judge_col in JUDGE_COLUMNS:
         if judge_col in df.columns:
             judge_name = judge_col.replace('_Judge_Rating', '')
             log_and_print(logger, "\n" + "="*80)
             log_and_print(logger, f"{judge_name.upper()} JUDGE")
             log_and_print(logger, "="*80)
 
+            if judge_col in cascade_columns:
+                judge_n = compute_accuracy(df[judge_col].tolist())[1]
+                log_and_print(logger, f"\nSkipped: rated only the {judge_n:,} pairs the other judges disagreed on "
+                                      f"(--cascade), so its scores are not comparable with the other judges.")
+                continue
+
             if 'teacher' in df['QA Type'].values:
                 teacher_df = df[df['QA Type'] == 'teacher']
                 ratings = teacher_df[judge_col].tolist()
@@ -263,6 +383,8 @@ def main():
     parser.add_argument('--skip-metrics', action='store_true', help='Skip BERTScore/ROUGE computation')
     parser.add_argument('--skip-ensemble', action='store_true', help='Skip ensemble judge computation')
     parser.add_argument('--skip-scores', action='store_true', help='Skip benchmark score computation')
+    parser.add_argument('--skip-samples', action='store_true', help='Skip self-consistency sample metrics')
+    parser.add_argument('--pass-k', type=int, nargs='+', help='k values for pass@k (default: 1 and n)')
 
     args = parser.parse_args()
 
@@ -301,11 +423,19 @@ def main():
         fieldnames = add_ensemble_judge(data, logger)
         write_csv_from_dicts(args.csv_file, data, fieldnames)
 
+    if not args.skip_samples:
+        log_and_print(logger, "\n" + "="*80)
+        log_and_print(logger, "STEP 3: Self-Consistency Samples")
+        log_and_print(logger, "="*80)
+        fieldnames = compute_sample_consistency(data, logger, args.pass_k)
+        if 'Sample_Agreement' in fieldnames:
+            write_csv_from_dicts(args.csv_file, data, fieldnames)
+
     if not args.skip_scores:
         log_and_print(logger, "\n" + "="*80)
-        log_and_print(logger, "STEP 3: Computing Benchmark Scores")
+        log_and_print(logger, "STEP 4: Computing Benchmark Scores")
         log_and_print(logger, "="*80)
-        compute_benchmark_scores(data, logger)
+        compute_benchmark_scores(data, logger, cascade_judge_columns(args.csv_file))
 
     log_and_print(logger, "\n" + "="*80)
     log_and_print(logger, "Evaluation Complete!")
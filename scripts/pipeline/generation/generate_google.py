@@ -4,12 +4,11 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import os
 import csv
-import time
 import logging
-from PIL import Image
-import google.generativeai as genai
 from dotenv import load_dotenv
 from prompts import GENERATE_ANSWER_PROMPT
+from registry import load_provider
+from shared_utils import answer_columns, install_shutdown_handlers, shutdown_requested, wait_or_shutdown
 
 load_dotenv()
 
@@ -56,6 +55,7 @@ LOG_FILE = f"{LOG_DIR}/generation.log"
 RATE_LIMIT = 150
 SLEEP_TIME = 60
 SAVE_INTERVAL = 10
+NUM_SAMPLES = 1
 
 
 def setup_logger():
@@ -95,12 +95,21 @@ def write_csv_from_dicts(filepath, data, fieldnames):
         writer.writerows(data)
 
 
+def candidate_texts(response):
+    """Return the text of every candidate; response.text only works for a single candidate."""
+    texts = [''.join(part.text for part in candidate.content.parts) for candidate in response.candidates]
+    if not texts:
+        raise ValueError("No candidates in response")
+    return texts
+
+
 def process_row(row, model, logger):
-    """Generate model answer for a single question using vision API."""
+    """Generate NUM_SAMPLES model answers for a single question using vision API."""
     try:
         image_id = row["Image Name"]
         question = row["Question"]
         image_path = os.path.join(IMAGE_FOLDER, image_id)
+        from PIL import Image
         image = Image.open(image_path)
 
         user_prompt = "Answer the following question: " + str(question)
@@ -108,34 +117,44 @@ def process_row(row, model, logger):
 
         response = model.generate_content([full_prompt, image])
 
-        return response.text
+        return candidate_texts(response)
     except Exception as e:
         error_msg = str(e).lower()
         if 'rate' in error_msg or 'quota' in error_msg or '429' in error_msg:
             logger.info(f"  Real rate limit hit, sleeping {SLEEP_TIME}s...")
-            time.sleep(SLEEP_TIME)
+            if wait_or_shutdown(SLEEP_TIME):
+                return []
             try:
                 response = model.generate_content([full_prompt, image])
-                return response.text
+                return candidate_texts(response)
             except Exception as retry_e:
                 logger.error(f"Error after retry: {retry_e}")
-                return "Error"
+                return ["Error"] * NUM_SAMPLES
         logger.error(f"Error processing row: {e}")
-        return "Error"
+        return ["Error"] * NUM_SAMPLES
+
 
+def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger, on_answer=None):
+    """Generate answers for all unanswered questions, with checkpointing and rate limiting.
 
-def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger):
-    """Generate answers for all unanswered questions, with checkpointing and rate limiting."""
+    `on_answer(row)` is called after each row receives its answers, e.g. to stream rows to the judges.
+    """
 
+    genai = load_provider("google")
     genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    model = genai.GenerativeModel(MODEL_NAME)
+    model = genai.GenerativeModel(
+        MODEL_NAME,
+        generation_config=genai.GenerationConfig(candidate_count=NUM_SAMPLES)
+    )
 
     fieldnames = list(data[0].keys()) if data else []
 
-    if "Model Answer" not in fieldnames:
-        fieldnames.append("Model Answer")
-        for row in data:
-            row["Model Answer"] = ""
+    answer_cols = answer_columns(NUM_SAMPLES)
+    for column in answer_cols:
+        if column not in fieldnames:
+            fieldnames.append(column)
+            for row in data:
+                row[column] = ""
 
     qa_types_to_process = []
     if teacher:
@@ -147,11 +166,13 @@ def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger):
 
     rows_to_process = []
     for i, row in enumerate(data):
-        if row.get("Model Answer", "").strip() == "" and row["QA Type"] in qa_types_to_process:
+        missing_answer = any(row.get(column, "").strip() == "" for column in answer_cols)
+        if missing_answer and row["QA Type"] in qa_types_to_process:
             rows_to_process.append((i, row))
 
     logger.info(f"Model: {MODEL_NAME}")
     logger.info(f"Processing QA Types: {qa_types_to_process}")
+    logger.info(f"Samples per question: {NUM_SAMPLES}")
     logger.info(f"Total rows to process: {len(rows_to_process)}")
     logger.info(f"Output: {OUTPUT_CSV}")
 
@@ -159,13 +180,21 @@ def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger):
     processed_count = 0
 
     for idx, (data_idx, row) in enumerate(rows_to_process):
+        if shutdown_requested():
+            logger.info(f"Shutdown requested, stopping after {processed_count} rows")
+            break
+
         processed_count += 1
 
         if processed_count % 10 == 0:
             logger.info(f"Progress: {processed_count}/{len(rows_to_process)} rows ({100*processed_count//len(rows_to_process)}%)")
 
-        answer = process_row(row, model, logger)
-        data[data_idx]["Model Answer"] = answer
+        missing_cols = [column for column in answer_cols if row.get(column, "").strip() == ""]
+        answers = process_row(row, model, logger)
+        for column, answer in zip(missing_cols, answers):
+            data[data_idx][column] = answer
+        if answers and on_answer:
+            on_answer(data[data_idx])
 
         request_count += 1
 
@@ -178,6 +207,7 @@ def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger):
 
 
 def main():
+    install_shutdown_handlers()
     logger = setup_logger()
     logger.info("="*80)
     logger.info(f"Starting Google VQA Generation - {MODEL_NAME}")
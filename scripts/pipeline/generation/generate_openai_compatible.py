@@ -0,0 +1,253 @@
+"""
+Generation backend for self-hosted OpenAI-compatible inference servers (vLLM, SGLang, TGI, ...).
+
+Continuous-batching servers only reach peak throughput with hundreds of requests in flight,
+so this backend keeps a large keep-alive connection pool and a bounded window of concurrent
+requests instead of the one-at-a-time loop used by the hosted-API generators.
+
+Usage:
+    python generate_openai_compatible.py --base-url http://localhost:8000/v1 --model Qwen/Qwen2.5-VL-7B-Instruct
+"""
+
+import os
+import re
+import sys
+import csv
+import base64
+import logging
+import argparse
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prompts import GENERATE_ANSWER_PROMPT
+from registry import create_client
+from shared_utils import answer_columns, install_shutdown_handlers, shutdown_requested
+
+load_dotenv()
+
+OUTPUT_ROOT = "../../../output"
+IMAGE_FOLDER = "../../../data/AllImages/Resized_Merged_Problem_Images"
+LOG_ROOT = "../../../logs"
+
+MAX_IN_FLIGHT = 256
+REQUEST_TIMEOUT = 600
+MAX_RETRIES = 3
+SAVE_INTERVAL = 500
+SHUTDOWN_GRACE = 30
+IMAGE_CACHE_SIZE = 512
+
+
+def setup_logger(log_file):
+    """Configure logging to file and console, suppressing verbose HTTP logs."""
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logging.getLogger('httpcore').setLevel(logging.WARNING)
+    logging.getLogger('openai').setLevel(logging.WARNING)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        handlers=[
+            logging.FileHandler(log_file, mode='a', encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+
+def read_csv_as_dicts(filepath):
+    """Load CSV file into list of dictionaries."""
+    with open(filepath, 'r', encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def write_csv_from_dicts(filepath, data, fieldnames):
+    """Write list of dictionaries to CSV file."""
+    with open(filepath, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(data)
+
+
+def default_csv_name(model_name):
+    """Derive an output CSV name from a model name, e.g. 'Qwen/Qwen2.5-VL-7B' -> 'qwen2.5_vl_7b'."""
+    return re.sub(r'[^a-z0-9.]+', '_', model_name.split('/')[-1].lower()).strip('_')
+
+
+def create_pooled_client(base_url, api_key, max_in_flight):
+    """Create an OpenAI client whose connection pool can hold every in-flight request open."""
+    import httpx
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=max_in_flight,
+            max_keepalive_connections=max_in_flight,
+            keepalive_expiry=60,
+        ),
+        timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=30),
+    )
+    return create_client("openai", base_url=base_url, api_key=api_key, max_retries=MAX_RETRIES, http_client=http_client)
+
+
+@lru_cache(maxsize=IMAGE_CACHE_SIZE)
+def encode_image(image_path):
+    """Base64-encode an image once; many QA pairs share the same image."""
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
+
+
+def process_row(row, client, model_name, num_samples, logger):
+    """Generate num_samples model answers for a single question using vision API."""
+    try:
+        image_path = os.path.join(IMAGE_FOLDER, row["Image Name"])
+        encoded_image = encode_image(image_path)
+
+        user_prompt = "Answer the following question: " + str(row["Question"])
+
+        response = client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": GENERATE_ANSWER_PROMPT},
+                {"role": "user", "content": [
+                    {
+                        "type": "text", "text": user_prompt
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{encoded_image}"
+                        }
+                    }
+                ]}
+            ],
+            n=num_samples,
+        )
+
+        return [choice.message.content for choice in response.choices]
+    except Exception as e:
+        logger.error(f"Error processing row: {e}")
+        return ["Error"] * num_samples
+
+
+def run_generation(data, client, model_name, output_csv, max_in_flight, num_samples, logger, on_answer=None):
+    """Generate answers for all unanswered questions, keeping up to max_in_flight requests open.
+
+    `on_answer(row)` is called after each row receives its answers, e.g. to stream rows to the judges.
+    """
+    fieldnames = list(data[0].keys()) if data else []
+
+    answer_cols = answer_columns(num_samples)
+    for column in answer_cols:
+        if column not in fieldnames:
+            fieldnames.append(column)
+            for row in data:
+                row[column] = ""
+
+    rows_to_process = [
+        (i, row) for i, row in enumerate(data)
+        if any(row.get(column, "").strip() == "" for column in answer_cols)
+    ]
+
+    logger.info(f"Model: {model_name}")
+    logger.info(f"Max in-flight requests: {max_in_flight}")
+    logger.info(f"Samples per question: {num_samples}")
+    logger.info(f"Total rows to process: {len(rows_to_process)}")
+    logger.info(f"Output: {output_csv}")
+
+    if not rows_to_process:
+        return
+
+    pending_rows = iter(rows_to_process)
+    in_flight = {}
+    completed = 0
+
+    def record_answers(done):
+        nonlocal completed
+        for future in done:
+            row = data[in_flight.pop(future)]
+            missing_cols = [column for column in answer_cols if row.get(column, "").strip() == ""]
+            for column, answer in zip(missing_cols, future.result()):
+                row[column] = answer
+            if on_answer:
+                on_answer(row)
+            completed += 1
+
+            if completed % SAVE_INTERVAL == 0:
+                logger.info(f"Progress: {completed}/{len(rows_to_process)} rows ({100*completed//len(rows_to_process)}%)")
+                write_csv_from_dicts(output_csv, data, fieldnames)
+
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        while True:
+            while len(in_flight) < max_in_flight and not shutdown_requested():
+                next_row = next(pending_rows, None)
+                if next_row is None:
+                    break
+                data_idx, row = next_row
+                future = executor.submit(process_row, row, client, model_name, num_samples, logger)
+                in_flight[future] = data_idx
+
+            if shutdown_requested():
+                logger.info(f"Shutdown requested, waiting up to {SHUTDOWN_GRACE}s for {len(in_flight)} in-flight requests")
+                done, _ = wait(in_flight, timeout=SHUTDOWN_GRACE)
+                record_answers(done)
+                if in_flight:
+                    logger.info(f"Abandoning {len(in_flight)} unfinished requests; they will be retried on the next run")
+                    client.close()
+                break
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, timeout=1, return_when=FIRST_COMPLETED)
+            record_answers(done)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    write_csv_from_dicts(output_csv, data, fieldnames)
+    if shutdown_requested():
+        logger.info(f"Flushed {completed} answers before shutdown")
+    else:
+        logger.info("Generation complete")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate answers with a self-hosted OpenAI-compatible server')
+    parser.add_argument('--base-url', required=True, help='Server base URL, e.g. http://localhost:8000/v1')
+    parser.add_argument('--model', required=True, help='Model name as served by the endpoint')
+    parser.add_argument('--csv-name', help='Output CSV name without extension (default: derived from --model)')
+    parser.add_argument('--api-key', default=os.getenv("OPENAI_COMPATIBLE_API_KEY", "EMPTY"),
+                        help='API key, if the server requires one')
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT,
+                        help=f'Maximum concurrent requests (default: {MAX_IN_FLIGHT})')
+    parser.add_argument('--num-samples', type=int, default=1,
+                        help='Completions per question, requested with `n` (default: 1)')
+    args = parser.parse_args()
+
+    install_shutdown_handlers()
+    csv_name = args.csv_name or default_csv_name(args.model)
+    input_csv = f"{OUTPUT_ROOT}/{csv_name}.csv"
+    output_csv = f"{OUTPUT_ROOT}/{csv_name}.csv"
+
+    logger = setup_logger(f"{LOG_ROOT}/{csv_name}/generation.log")
+    logger.info("="*80)
+    logger.info(f"Starting OpenAI-compatible VQA Generation - {args.model} @ {args.base_url}")
+    logger.info("="*80)
+
+    data = read_csv_as_dicts(input_csv)
+    logger.info(f"Loaded dataset: {input_csv} ({len(data)} rows)")
+
+    client = create_pooled_client(args.base_url, args.api_key, args.max_in_flight)
+    run_generation(data, client, args.model, output_csv, args.max_in_flight, args.num_samples, logger)
+
+    logger.info("="*80)
+    logger.info("Generation complete")
+    logger.info("="*80)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
 import os
 import sys
 import csv
-import time
 import base64
 import logging
-from together import Together
 from dotenv import load_dotenv
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from prompts import GENERATE_ANSWER_PROMPT
+from registry import create_client
+from shared_utils import answer_columns, install_shutdown_handlers, shutdown_requested, wait_or_shutdown
 
 load_dotenv()
 
@@ -35,6 +35,7 @@ LOG_FILE = f"{LOG_DIR}/generation.log"
 RATE_LIMIT = 150
 SLEEP_TIME = 60
 SAVE_INTERVAL = 10
+NUM_SAMPLES = 1
 
 
 def setup_logger():
@@ -102,24 +103,30 @@ def process_row(row, client, logger):
                     }
                 ]}
             ],
+            n=NUM_SAMPLES,
         )
 
-        return response.choices[0].message.content
+        return [choice.message.content for choice in response.choices]
     except Exception as e:
         logger.error(f"Error processing row: {e}")
-        return "Error"
+        return ["Error"] * NUM_SAMPLES
 
 
-def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger):
-    """Generate answers for all unanswered questions, with checkpointing and rate limiting."""
-    client = Together(api_key=os.getenv("TOGETHER_API_KEY"))
+def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger, on_answer=None):
+    """Generate answers for all unanswered questions, with checkpointing and rate limiting.
+
+    `on_answer(row)` is called after each row receives its answers, e.g. to stream rows to the judges.
+    """
+    client = create_client("together", api_key=os.getenv("TOGETHER_API_KEY"))
 
     fieldnames = list(data[0].keys()) if data else []
 
-    if "Model Answer" not in fieldnames:
-        fieldnames.append("Model Answer")
-        for row in data:
-            row["Model Answer"] = ""
+    answer_cols = answer_columns(NUM_SAMPLES)
+    for column in answer_cols:
+        if column not in fieldnames:
+            fieldnames.append(column)
+            for row in data:
+                row[column] = ""
 
     qa_types_to_process = []
     if teacher:
@@ -131,11 +138,13 @@ def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger):
 
     rows_to_process = []
     for i, row in enumerate(data):
-        if row.get("Model Answer", "").strip() == "" and row["QA Type"] in qa_types_to_process:
+        missing_answer = any(row.get(column, "").strip() == "" for column in answer_cols)
+        if missing_answer and row["QA Type"] in qa_types_to_process:
             rows_to_process.append((i, row))
 
     logger.info(f"Model: {MODEL_NAME}")
     logger.info(f"Processing QA Types: {qa_types_to_process}")
+    logger.info(f"Samples per question: {NUM_SAMPLES}")
     logger.info(f"Total rows to process: {len(rows_to_process)}")
     logger.info(f"Output: {OUTPUT_CSV}")
 
@@ -143,13 +152,21 @@ def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger):
     processed_count = 0
 
     for idx, (data_idx, row) in enumerate(rows_to_process):
+        if shutdown_requested():
+            logger.info(f"Shutdown requested, stopping after {processed_count} rows")
+            break
+
         processed_count += 1
 
         if processed_count % 10 == 0:
             logger.info(f"Progress: {processed_count}/{len(rows_to_process)} rows ({100*processed_count//len(rows_to_process)}%)")
 
-        answer = process_row(row, client, logger)
-        data[data_idx]["Model Answer"] = answer
+        missing_cols = [column for column in answer_cols if row.get(column, "").strip() == ""]
+        answers = process_row(row, client, logger)
+        for column, answer in zip(missing_cols, answers):
+            data[data_idx][column] = answer
+        if answers and on_answer:
+            on_answer(data[data_idx])
 
         request_count += 1
 
@@ -159,7 +176,7 @@ def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger):
 
         if request_count >= RATE_LIMIT:
             logger.info(f"  Rate limit reached, sleeping {SLEEP_TIME}s...")
-            time.sleep(SLEEP_TIME)
+            wait_or_shutdown(SLEEP_TIME)
             request_count = 0
 
     write_csv_from_dicts(OUTPUT_CSV, data, fieldnames)
@@ -167,6 +184,7 @@ def run_generation(data, teacher: bool, gpt4o: bool, claude: bool, logger):
 
 
 def main():
+    install_shutdown_handlers()
     logger = setup_logger()
     logger.info("="*80)
     logger.info(f"Starting Together AI VQA Generation - {MODEL_NAME}")
@@ -1,491 +1,215 @@
+"""
+Judge QA pairs with Claude through the Message Batches API.
+
+Usage:
+    python judge_claude.py <exploded_csv_file> [sample_index]
+
+Everything except job creation, polling and result iteration lives in judge_engine.py.
+"""
+
 import os
 import sys
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-import os
-import sys
 import json
-import time
-import traceback
-from glob import glob
-from datetime import datetime
-import anthropic
-from dotenv import load_dotenv
-from shared_utils import setup_logger, log_and_print, read_csv_as_dicts, write_csv_from_dicts
-from prompts import JUDGE_PROMPT_TEMPLATE
-
-load_dotenv()
-
-INPUT_FILE = sys.argv[1] if len(sys.argv) > 1 else None
-JUDGE_MODEL = "claude-sonnet-4-5"
-BATCH_SIZE = 1000
-API_KEY = os.getenv("ANTHROPIC_API_KEY")
-
-input_basename = os.path.basename(INPUT_FILE).replace('.csv', '') if INPUT_FILE else "unknown"
-RUN_ID = datetime.now().strftime("%Y%m%d_%H%M%S")
-OUTPUT_DIR = f"../../../output/claude_judge/{input_basename}/{RUN_ID}"
-LOG_DIR = f"../../../logs/{input_basename}"
-LOG_FILE = f"{LOG_DIR}/judge_claude.log"
-
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-os.makedirs(LOG_DIR, exist_ok=True)
-os.makedirs(f"{OUTPUT_DIR}/token_analysis", exist_ok=True)
-
-
-def generate_qa_id_fallback(row_idx):
-    """Generate QA ID from row index when missing from CSV."""
-    return f"qa_{row_idx:06d}"
-
-
-def load_existing_judgments(output_dir, logger):
-    """Load previously judged QA pair IDs from ALL timestamp directories."""
-    judged_ids = set()
-
-    parent_dir = os.path.dirname(output_dir)
-
-    timestamp_dirs = []
-    if os.path.exists(parent_dir):
-        for item in os.listdir(parent_dir):
-            item_path = os.path.join(parent_dir, item)
-            if os.path.isdir(item_path):
-                timestamp_dirs.append(item_path)
-
-    if output_dir not in timestamp_dirs:
-        timestamp_dirs.append(output_dir)
-
-    all_batch_files = []
-    for ts_dir in timestamp_dirs:
-        batch_files = sorted(glob(os.path.join(ts_dir, "batch_*.csv")))
-        all_batch_files.extend(batch_files)
+import hashlib
+from prompts import JUDGE_RESPONSE_SCHEMA, JUDGE_MULTI_RESPONSE_SCHEMA
+from judge_engine import (JudgeBackend, structured_judgment, parse_judge_response, failed_results,
+                          main_for_backend)
+from registry import create_client, load_provider
 
-    if not all_batch_files:
-        log_and_print(logger, "No existing batch files found in any timestamp directory")
-        return judged_ids
-
-    log_and_print(logger, f"Found {len(all_batch_files)} existing batch files across {len(timestamp_dirs)} timestamp directories")
-
-    for batch_file in all_batch_files:
-        try:
-            batch_data = read_csv_as_dicts(batch_file)
-            for row in batch_data:
-                qa_id = row.get('QA_Pair_ID', '').strip()
-                if qa_id:
-                    rating = row.get('Judge_Rating', '').strip()
-                    if rating:
-                        try:
-                            rating_val = float(rating)
-                            if 1 <= rating_val <= 4:
-                                judged_ids.add(qa_id)
-                        except (ValueError, TypeError):
-                            pass
-        except Exception as e:
-            log_and_print(logger, f"Warning: Failed to read {batch_file}: {e}")
-
-    log_and_print(logger, f"Loaded {len(judged_ids)} already-judged QA pairs from all runs")
-    return judged_ids
-
-
-def run_batch_judge(client, qa_pairs, logger):
-    """Execute batch judging using Claude API, polling until completion."""
-    log_and_print(logger, f"  Creating batch job with {len(qa_pairs)} requests...")
-
-    requests = []
-    for i, qa in enumerate(qa_pairs):
-        reference_answer = qa['reference_answer'].replace('\\', '\\\\')
-        model_answer = qa['model_answer'].replace('\\', '\\\\')
+JUDGE_MODEL = "claude-sonnet-4-5"
+MAX_LIST_PAGES = 10
+MAX_ACTIVE_BATCHES = 100
+MAX_QUEUED_REQUESTS = 100_000  # requests in the Message Batches processing queue at the lowest rate-limit tier
+
+# Forcing this tool makes Claude return the judgment as schema-checked tool input instead of free text.
+JUDGMENT_TOOL = {
+    'name': 'record_judgment',
+    'description': 'Record the 1-4 rating of Answer 2 and a brief justification.',
+    'input_schema': JUDGE_RESPONSE_SCHEMA
+}
+MULTI_JUDGMENT_TOOL = {
+    'name': 'record_judgments',
+    'description': 'Record the 1-4 rating of each item\'s Answer 2 and a brief justification.',
+    'input_schema': JUDGE_MULTI_RESPONSE_SCHEMA
+}
+
+
+def request_id(qa):
+    """Claude custom IDs must match ^[a-zA-Z0-9_-]{1,64}$, so send a stable hash of the tagged ID."""
+    return 'req_' + hashlib.sha256(qa['custom_id'].encode('utf-8')).hexdigest()[:32]
+
+
+class ClaudeBackend(JudgeBackend):
+    name = 'claude'
+    title = 'Claude'
+    judge_model = JUDGE_MODEL
+    api_key_env = 'ANTHROPIC_API_KEY'
+    log_name = 'judge_claude.log'
+    max_active_batches = MAX_ACTIVE_BATCHES
+    max_queued_requests = MAX_QUEUED_REQUESTS
+    max_batch_requests = 100_000
+    max_batch_bytes = 256 * 1024**2          # 256 MB per Message Batches create call
+    realtime_requests_per_minute = 50        # Messages API limit at the lowest rate-limit tier
+
+    def __init__(self, api_key, run_id, logger):
+        super().__init__(api_key, run_id, logger)
+        self.client = create_client("anthropic", api_key=api_key)
+
+    def prompt_fields(self, qa):
+        return super().prompt_fields({
+            'question': qa['question'],
+            'reference_answer': qa['reference_answer'].replace('\\', '\\\\'),
+            'model_answer': qa['model_answer'].replace('\\', '\\\\')
+        })
 
-        prompt = JUDGE_PROMPT_TEMPLATE.format(
-            question=qa['question'],
-            teacher_a=reference_answer,
-            model_a=model_answer
-        )
+    def build_request(self, qa):
+        """One entry of the Message Batches create call.
 
+        The judgment tool and the rubric system block form a prefix shared by every request; the
+        cache_control marker on the system block lets batch requests read it from the prompt cache.
+        """
         request = {
-            'custom_id': f'req_{i}',
+            'custom_id': request_id(qa),
             'params': {
                 'model': JUDGE_MODEL,
                 'max_tokens': 10000,
+                'system': [{
+                    'type': 'text',
+                    'text': self.system_prompt(qa),
+                    'cache_control': {'type': 'ephemeral'}
+                }],
                 'messages': [{
                     'role': 'user',
-                    'content': prompt
+                    'content': self.format_prompt(qa)
                 }]
             }
         }
-        requests.append(request)
+        if self.structured_output:
+            tool = MULTI_JUDGMENT_TOOL if 'items' in qa else JUDGMENT_TOOL
+            request['params']['tools'] = [tool]
+            request['params']['tool_choice'] = {'type': 'tool', 'name': tool['name']}
+        return request
 
-    log_and_print(logger, f"  Submitting batch job...")
+    def submit(self, batch_num, qa_pairs):
+        """Submit one batch of judging requests to the Claude Batch API; returns the job, None, or 'requeue'
+        when the processing queue or rate limit is full."""
+        self.log(f"  Creating batch job with {len(qa_pairs)} requests...")
 
-    batch = client.beta.messages.batches.create(requests=requests)
+        requests = [self.build_request(qa) for qa in qa_pairs]
 
-    log_and_print(logger, f"  Batch job created: {batch.id}")
-    log_and_print(logger, f"  Status: {batch.processing_status}")
-    log_and_print(logger, f"  Waiting for completion...")
+        self.log(f"  Submitting batch job...")
 
-    poll_count = 0
-    while True:
-        time.sleep(30)
-        poll_count += 1
-
-        batch = client.beta.messages.batches.retrieve(batch.id)
+        anthropic = load_provider("anthropic")
+        try:
+            batch = self.client.beta.messages.batches.create(requests=requests)
+        except anthropic.RateLimitError as e:
+            self.log(f"  Batch creation rate-limited: {e}")
+            return 'requeue'
+        except anthropic.APIError as e:
+            self.log(f"  ERROR: Batch creation failed: {e}")
+            return None
 
-        if poll_count % 2 == 0:
-            log_and_print(logger, f"    Status: {batch.processing_status} (poll {poll_count})")
+        self.log(f"  Batch job created: {batch.id}")
+        self.log(f"  Status: {batch.processing_status}")
 
-        if batch.processing_status == "ended":
-            break
-        elif batch.processing_status in ["canceled", "expired"]:
-            log_and_print(logger, f"  ERROR: Batch job {batch.processing_status}")
-            return {qa['id']: {'rating': -1, 'reason': f'Batch {batch.processing_status}'}
-                    for qa in qa_pairs}, {'input_tokens': 0, 'output_tokens': 0, 'total_tokens': 0}, []
+        return {'id': batch.id, 'state': batch.processing_status}
 
-    log_and_print(logger, f"  Batch job finished: {batch.processing_status}")
+    @staticmethod
+    def update_job(job, batch):
+        """Apply a batch from the API to a job; returns 'done' once the batch has ended."""
+        job['state'] = batch.processing_status
 
-    log_and_print(logger, f"  Downloading results using SDK...")
+        counts = batch.request_counts
+        total = counts.processing + counts.succeeded + counts.errored + counts.canceled + counts.expired
+        job['progress'] = (total - counts.processing, total)
 
-    result_map = {}
-    total_input_tokens = 0
-    total_output_tokens = 0
-    result_entries = []
+        return 'done' if batch.processing_status in ["ended", "canceled", "expired"] else 'running'
 
-    for result_entry in client.beta.messages.batches.results(batch.id):
-        result_entries.append(result_entry)
+    def list_batches(self, job_ids):
+        """Fetch recent batches with the list endpoint, stopping once every job in job_ids is found."""
+        found = {}
         try:
-            custom_id = result_entry.custom_id
-            result = result_entry.result
-
-            if result.type == 'succeeded':
-                message = result.message
-
-                if hasattr(message, 'usage'):
-                    usage = message.usage
-                    input_tokens = usage.input_tokens if hasattr(usage, 'input_tokens') else 0
-                    output_tokens = usage.output_tokens if hasattr(usage, 'output_tokens') else 0
-                    total_input_tokens += input_tokens
-                    total_output_tokens += output_tokens
-                else:
-                    input_tokens = 0
-                    output_tokens = 0
-
-                if message.content and len(message.content) > 0:
-                    content_block = message.content[0]
-                    text = content_block.text if hasattr(content_block, 'text') else str(content_block)
-
-                    if text.startswith('```'):
-                        lines = text.split('\n')
-                        if lines[0].startswith('```'):
-                            lines = lines[1:]
-                        if lines and lines[-1].strip() == '```':
-                            lines = lines[:-1]
-                        text = '\n'.join(lines).strip()
-
-                    try:
-                        import re
-                        json_match = re.search(r'\{[^{}]*"rating"[^{}]*"reason"[^{}]*\}', text)
-                        if json_match:
-                            text = json_match.group(0)
-
-                        text = re.sub(r'\\(?!["\\/bfnrtu])', r'\\\\', text)
-
-                        response_json = json.loads(text)
-                        result_map[custom_id] = {
-                            'rating': response_json.get('rating', -1),
-                            'reason': response_json.get('reason', 'Parse error'),
-                            'text': text,
-                            'input_tokens': input_tokens,
-                            'output_tokens': output_tokens
-                        }
-                    except Exception as e:
-                        result_map[custom_id] = {
-                            'rating': -1,
-                            'reason': f'Parse error: {e} (text={text if text else "EMPTY"})',
-                            'text': text,
-                            'input_tokens': input_tokens,
-                            'output_tokens': output_tokens
-                        }
-                else:
-                    result_map[custom_id] = {
-                        'rating': -1,
-                        'reason': 'Empty response',
-                        'text': '',
-                        'input_tokens': input_tokens,
-                        'output_tokens': output_tokens
-                    }
-            elif result.type == 'errored':
-                error = result.error
-                error_msg = error.message if hasattr(error, 'message') else 'Unknown error'
-                result_map[custom_id] = {
-                    'rating': -1,
-                    'reason': f'API error: {error_msg}',
-                    'text': '',
-                    'input_tokens': 0,
-                    'output_tokens': 0
-                }
-            else:
-                result_map[custom_id] = {
-                    'rating': -1,
-                    'reason': f'Unknown result type: {result.type}',
-                    'text': '',
-                    'input_tokens': 0,
-                    'output_tokens': 0
-                }
+            for scanned, batch in enumerate(self.client.beta.messages.batches.list(limit=100), 1):
+                if batch.id in job_ids:
+                    found[batch.id] = batch
+                if len(found) == len(job_ids) or scanned >= MAX_LIST_PAGES * 100:
+                    break
         except Exception as e:
-            log_and_print(logger, f"  Warning: Failed to parse result: {e}")
-
-    results = {}
-    for i, qa in enumerate(qa_pairs):
-        custom_id = f'req_{i}'
-        qa_id = qa['id']
-        if custom_id in result_map:
-            results[qa_id] = result_map[custom_id]
-        else:
-            results[qa_id] = {
-                'rating': -1,
-                'reason': 'Missing response',
-                'text': '',
-                'input_tokens': 0,
-                'output_tokens': 0
-            }
+            self.log(f"  WARNING: Listing batches failed: {e}")
+        return found
 
-    success_count = sum(1 for r in results.values() if r['rating'] != -1)
-    log_and_print(logger, f"  Completed: {success_count} success, {len(results)-success_count} errors")
-
-    total_tokens = total_input_tokens + total_output_tokens
-    log_and_print(logger, f"  Token Usage - Input: {total_input_tokens:,}, Output: {total_output_tokens:,}, Total: {total_tokens:,}")
-
-    token_usage = {
-        'input_tokens': total_input_tokens,
-        'output_tokens': total_output_tokens,
-        'total_tokens': total_tokens
-    }
-
-    return results, token_usage, result_entries
-
-
-def save_detailed_token_analysis(batch_num, qa_pairs, result_entries, results, token_usage, output_dir):
-    """Save per-request token usage with full prompts and responses for analysis."""
-    log_dir = os.path.join(output_dir, "token_analysis")
-    os.makedirs(log_dir, exist_ok=True)
-
-    log_file = os.path.join(log_dir, f"batch_{batch_num:04d}_token_details.json")
-
-    detailed_entries = []
-    for qa in qa_pairs:
-        qa_id = qa['id']
-        result = results.get(qa_id, {})
-
-        entry = {
-            'qa_id': qa_id,
-            'request': {
-                'question': qa['question'],
-                'model_answer': qa['model_answer'],
-                'reference_answer': qa['reference_answer'],
-                'full_prompt': JUDGE_PROMPT_TEMPLATE.format(
-                    question=qa['question'],
-                    teacher_a=qa['reference_answer'],
-                    model_a=qa['model_answer']
-                )
-            },
-            'response': {
-                'rating': result.get('rating'),
-                'reason': result.get('reason'),
-                'full_response_text': result.get('text')
-            },
-            'tokens': {
-                'input_tokens': result.get('input_tokens', 0),
-                'output_tokens': result.get('output_tokens', 0),
-                'total_tokens': result.get('input_tokens', 0) + result.get('output_tokens', 0)
-            }
-        }
-
-        detailed_entries.append(entry)
-
-    log_data = {
-        'timestamp': datetime.now().isoformat(),
-        'batch_number': batch_num,
-        'num_qa_pairs': len(qa_pairs),
-        'token_summary': token_usage,
-        'detailed_entries': detailed_entries
-    }
-
-    with open(log_file, 'w', encoding='utf-8') as f:
-        json.dump(log_data, f, indent=2)
-
-
-def write_batch_output(batch_num, qa_pairs, results, output_dir, logger):
-    """Write judging results for this batch to CSV file."""
-    output_file = os.path.join(output_dir, f"batch_{batch_num:04d}.csv")
-
-    rows = []
-    for qa in qa_pairs:
-        qa_id = qa['id']
-        result = results.get(qa_id, {'rating': -1, 'reason': 'Missing result'})
-        rows.append({
-            'QA_Pair_ID': qa_id,
-            'Question': qa['question'],
-            'Model_Answer': qa['model_answer'],
-            'Reference_Answer': qa['reference_answer'],
-            'Judge_Rating': result['rating'],
-            'Judge_Reason': result['reason']
-        })
-
-    fieldnames = ['QA_Pair_ID', 'Question', 'Model_Answer', 'Reference_Answer', 'Judge_Rating', 'Judge_Reason']
-    write_csv_from_dicts(output_file, rows, fieldnames)
-    log_and_print(logger, f"  Written {len(rows)} results to {output_file}")
-
-
-def save_token_summary(output_dir, total_stats):
-    """Save cumulative token usage summary"""
-    summary_file = os.path.join(output_dir, "token_usage_summary.json")
-
-    summary = {
-        'timestamp': datetime.now().isoformat(),
-        'total_qa_pairs': total_stats['num_pairs'],
-        'total_batches': total_stats['num_batches'],
-        'token_usage': {
-            'input_tokens': total_stats['input_tokens'],
-            'output_tokens': total_stats['output_tokens'],
-            'total_tokens': total_stats['total_tokens']
-        },
-        'average_per_qa': {
-            'input_tokens': round(total_stats['input_tokens'] / total_stats['num_pairs'], 2) if total_stats['num_pairs'] > 0 else 0,
-            'output_tokens': round(total_stats['output_tokens'] / total_stats['num_pairs'], 2) if total_stats['num_pairs'] > 0 else 0,
-            'total_tokens': round(total_stats['total_tokens'] / total_stats['num_pairs'], 2) if total_stats['num_pairs'] > 0 else 0
+    def poll_batch(self, job):
+        """Refresh one batch job's status; returns 'done' once the batch has ended."""
+        try:
+            return self.update_job(job, self.client.beta.messages.batches.retrieve(job['id']))
+        except Exception as e:
+            self.log(f"  WARNING: Poll of {job['id']} failed: {e}")
+            return 'running'
+
+    def poll_jobs(self, jobs):
+        """Refresh all jobs with one list call where possible, falling back to per-job polls."""
+        listed = self.list_batches({job['id'] for job in jobs}) if len(jobs) > 1 else {}
+        return {
+            job['id']: self.update_job(job, listed[job['id']]) if job['id'] in listed else self.poll_batch(job)
+            for job in jobs
         }
-    }
-
-    with open(summary_file, 'w') as f:
-        json.dump(summary, f, indent=2)
 
+    def iter_results(self, job, qa_pairs):
+        """Stream and parse the results of a finished batch job through the SDK's JSONL iterator."""
+        if job['state'] in ["canceled", "expired"]:
+            self.log(f"  ERROR: Batch job {job['state']}")
+            yield from failed_results(qa_pairs, f'Batch {job["state"]}').items()
+            return
 
-def main():
-    if not INPUT_FILE:
-        print("Usage: python judge_claude.py <exploded_csv_file>")
-        sys.exit(1)
+        self.log(f"  Batch job finished: {job['state']}")
+        self.log(f"  Downloading results using SDK...")
 
-    if not API_KEY:
-        print("ERROR: ANTHROPIC_API_KEY not found in environment")
-        sys.exit(1)
+        custom_ids = {request_id(qa): qa['custom_id'] for qa in qa_pairs}
 
-    logger = setup_logger(LOG_FILE)
-    log_and_print(logger, "="*80)
-    log_and_print(logger, f"Claude Judge")
-    log_and_print(logger, f"Input: {INPUT_FILE}")
-    log_and_print(logger, f"Judge Model: {JUDGE_MODEL}")
-    log_and_print(logger, f"Output Directory: {OUTPUT_DIR}")
-    log_and_print(logger, f"Batch Size: {BATCH_SIZE}")
-    log_and_print(logger, "="*80)
+        for result_entry in self.client.beta.messages.batches.results(job['id']):
+            try:
+                custom_id = custom_ids.get(result_entry.custom_id, result_entry.custom_id)
+                result = result_entry.result
 
-    log_and_print(logger, "\nLoading input file...")
-    data = read_csv_as_dicts(INPUT_FILE)
-    log_and_print(logger, f"Loaded {len(data)} rows from CSV")
-
-    log_and_print(logger, "\nChecking for existing judgments...")
-    judged_ids = load_existing_judgments(OUTPUT_DIR, logger)
-
-    log_and_print(logger, "\nCollecting QA pairs to judge...")
-    qa_pairs = []
-    skipped_from_csv = 0
-
-    for row_idx, row in enumerate(data):
-        qa_id = row.get('QA_Pair_ID', '').strip()
-        if not qa_id:
-            qa_id = generate_qa_id_fallback(row_idx)
-            log_and_print(logger, f"  Warning: Row {row_idx} missing QA_Pair_ID, using fallback: {qa_id}")
-
-        if qa_id in judged_ids:
-            continue
-
-        existing_rating = str(row.get('Claude_Judge_Rating', '')).strip()
-        try:
-            rating_val = float(existing_rating) if existing_rating else -1
-            if rating_val >= 1 and rating_val <= 4:
-                skipped_from_csv += 1
+                if result.type == 'succeeded':
+                    parsed = self.parse_message(result.message)
+                elif result.type == 'errored':
+                    parsed = {'rating': -1, 'reason': f"API error: {getattr(result.error, 'message', 'Unknown error')}"}
+                else:
+                    parsed = {'rating': -1, 'reason': f'Unknown result type: {result.type}'}
+            except Exception as e:
+                self.log(f"  Warning: Failed to parse result: {e}")
                 continue
-        except (ValueError, TypeError):
-            pass
-
-        question = row.get('Question', '').strip()
-        model_answer = row.get('Model Answer', '').strip()
-        reference_answer = row.get('Reference Answer', '').strip()
-
-        if question and model_answer and reference_answer:
-            qa_pairs.append({
-                'id': qa_id,
-                'question': question,
-                'model_answer': model_answer,
-                'reference_answer': reference_answer
-            })
-
-    log_and_print(logger, f"Found {len(qa_pairs)} QA pairs to judge")
-    log_and_print(logger, f"Skipped {len(judged_ids)} already-judged pairs (from batch files)")
-    log_and_print(logger, f"Skipped {skipped_from_csv} already-judged pairs (from input CSV)")
-
-    if not qa_pairs:
-        log_and_print(logger, "\nNo new pairs to judge - all done!")
-        log_and_print(logger, "="*80)
-        return
-
-    client = anthropic.Anthropic(api_key=API_KEY)
-
-    num_batches = (len(qa_pairs) + BATCH_SIZE - 1) // BATCH_SIZE
-    log_and_print(logger, f"\nProcessing {num_batches} batch(es)...")
-
-    existing_batches = glob(os.path.join(OUTPUT_DIR, "batch_*.csv"))
-    start_batch_num = len(existing_batches) + 1
-
-    total_stats = {
-        'num_pairs': 0,
-        'num_batches': 0,
-        'input_tokens': 0,
-        'output_tokens': 0,
-        'total_tokens': 0
-    }
-
-    for batch_idx in range(num_batches):
-        batch_start = batch_idx * BATCH_SIZE
-        batch_end = min(batch_start + BATCH_SIZE, len(qa_pairs))
-        batch_qa_pairs = qa_pairs[batch_start:batch_end]
-
-        log_and_print(logger, f"\n--- Batch {batch_idx + 1}/{num_batches} ---")
-        log_and_print(logger, f"Processing QA pairs {batch_start} to {batch_end-1}")
-
-        results, token_usage, result_entries = run_batch_judge(client, batch_qa_pairs, logger)
-
-        total_stats['num_pairs'] += len(batch_qa_pairs)
-        total_stats['num_batches'] += 1
-        total_stats['input_tokens'] += token_usage['input_tokens']
-        total_stats['output_tokens'] += token_usage['output_tokens']
-        total_stats['total_tokens'] += token_usage['total_tokens']
-
-        write_batch_output(start_batch_num + batch_idx, batch_qa_pairs, results, OUTPUT_DIR, logger)
-
-        save_detailed_token_analysis(start_batch_num + batch_idx, batch_qa_pairs, result_entries, results, token_usage, OUTPUT_DIR)
-        log_and_print(logger, f"  Token analysis saved to {OUTPUT_DIR}/token_analysis/")
-
-    log_and_print(logger, "\n" + "="*80)
-    log_and_print(logger, "Judging complete!")
-    log_and_print(logger, f"Results written to: {OUTPUT_DIR}")
-    log_and_print(logger, "")
-    log_and_print(logger, "Stats:")
-    log_and_print(logger, f"  Input tokens:  {total_stats['input_tokens']:,}")
-    log_and_print(logger, f"  Output tokens: {total_stats['output_tokens']:,}")
-    log_and_print(logger, f"  Total tokens:  {total_stats['total_tokens']:,}")
-
-    save_token_summary(OUTPUT_DIR, total_stats)
-    log_and_print(logger, f"\nToken summary saved to: {OUTPUT_DIR}/token_usage_summary.json")
-    log_and_print(logger, "="*80)
+            yield custom_id, parsed
+
+    def judge_realtime(self, qa):
+        """Judge one pair with a synchronous Messages API call."""
+        return self.parse_message(self.client.messages.create(**self.build_request(qa)['params']))
+
+    @staticmethod
+    def parse_message(message):
+        """Turn one Message into a result with its token counts, preferring the judgment tool's input."""
+        tool_input = next((block.input for block in message.content or []
+                           if getattr(block, 'type', None) == 'tool_use'), None)
+        if tool_input is not None:
+            parsed = (structured_judgment(tool_input, json.dumps(tool_input))
+                      or parse_judge_response(json.dumps(tool_input)))
+        elif message.content and len(message.content) > 0:
+            content_block = message.content[0]
+            text = content_block.text if hasattr(content_block, 'text') else str(content_block)
+            parsed = parse_judge_response(text)
+        else:
+            parsed = {'rating': -1, 'reason': 'Empty response', 'text': ''}
+        usage = getattr(message, 'usage', None)
+        cache_read = getattr(usage, 'cache_read_input_tokens', 0) or 0
+        cache_write = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+        parsed['input_tokens'] = (getattr(usage, 'input_tokens', 0) or 0) + cache_read + cache_write
+        parsed['cached_input_tokens'] = cache_read
+        parsed['output_tokens'] = getattr(usage, 'output_tokens', 0) or 0
+        return parsed
 
 
 if __name__ == "__main__":
-    try:
-        main()
-    except Exception as e:
-        logger = setup_logger(LOG_FILE)
-        log_and_print(logger, "\n" + "="*80)
-        log_and_print(logger, "Fatal Error")
-        log_and_print(logger, "="*80)
-        log_and_print(logger, f"Error: {str(e)}")
-        log_and_print(logger, "\nFull traceback:")
-        log_and_print(logger, traceback.format_exc())
-        log_and_print(logger, "="*80)
-        sys.exit(1)
+    main_for_backend(ClaudeBackend, "judge_claude.py")
@@ -0,0 +1,1237 @@
+"""
+Judge engine shared by the Claude, Gemini and OpenAI batch judges.
+
+The engine owns everything that is the same for every provider: collecting QA pairs from the exploded
+CSV, skipping judged ones, local and cached pre-judging, the batch ledger, concurrent submission and
+polling, response parsing, batch CSV output and token accounting. A provider backend (ClaudeBackend in
+judge_claude.py, GeminiBackend in judge_gemini.py, OpenAIBackend in judge_gpt4o.py) only creates batch
+jobs, reports their status and turns finished jobs into per-pair response texts.
+
+Several model CSVs and judges can run in one process. Each judge packs the pending pairs of all CSVs
+into shared provider batches, with request IDs tagged by model, and writes the results back to each
+model's own output/{judge}_judge/{model}/ directory; all batches are polled by one BatchPoller.
+
+Small workloads (at most REALTIME_THRESHOLD pending pairs per judge, e.g. re-judging a few hundred rows)
+skip the batch API and are judged with concurrent real-time calls under a rate limiter, written to the
+same batch_NNNN.csv files. LocalBackend (judge_local.py) judges every workload this way against any
+OpenAI-compatible endpoint, e.g. a local inference server or stub_server.py.
+
+Opt-in multi-item requests (--items-per-request) judge several unrelated pairs per request; replies are
+split per pair, unparsed items are re-judged one per request, and --multi-item-check compares a sample
+against single-item judging. --listwise instead puts the answers of all input CSVs to one question into
+a single request, in random order, and writes each rating back to its model's output directory.
+
+Usage:
+    python judge_engine.py <exploded_csv_file> [<exploded_csv_file> ...] [--sample-index N]
+                           [--judges claude gemini openai local | --cascade] [--realtime-threshold N]
+                           [--items-per-request K | --listwise] [--multi-item-check N]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import re
+import csv
+import json
+import math
+import time
+import random
+import hashlib
+import itertools
+import argparse
+import importlib
+import traceback
+from glob import glob
+from concurrent.futures import wait, FIRST_COMPLETED
+from datetime import datetime
+from dotenv import load_dotenv
+from shared_utils import (setup_logger, log_and_print, read_csv_as_dicts, sample_suffix,
+                          install_shutdown_handlers, shutdown_requested, BatchLedger, reattach_batches,
+                          load_judged_ids, record_judged_ids, is_valid_rating, RateLimiter, DaemonThreadPool,
+                          CASCADE_MARKER)
+from prompts import (JUDGE_SYSTEM_PROMPT, JUDGE_PROMPT_TEMPLATE, JUDGE_INPUT_TEMPLATE, JUDGE_RESPONSE_SCHEMA,
+                     JUDGE_MULTI_SYSTEM_PROMPT, JUDGE_MULTI_PROMPT_TEMPLATE, JUDGE_ITEM_TEMPLATE,
+                     JUDGE_MULTI_RESPONSE_SCHEMA, JUDGE_LISTWISE_SYSTEM_PROMPT, JUDGE_LISTWISE_INPUT_TEMPLATE,
+                     JUDGE_LISTWISE_ITEM_TEMPLATE, JUDGE_LISTWISE_PROMPT_TEMPLATE)
+from batch_poller import BatchLane, run_concurrent_batches
+from judgment_cache import JudgmentCache, CACHE_FILE
+from local_judge import local_judgments
+from token_analysis import TokenAnalysisWriter, summarize_token_analysis
+
+load_dotenv()
+
+# Batches are packed up to each backend's request and byte limits; set these to impose a lower ceiling.
+MAX_BATCH_REQUESTS = None
+MAX_BATCH_BYTES = None
+BATCH_BYTES_HEADROOM = 0.95  # stay under the byte limit since it is measured on the serialized requests
+USE_STRUCTURED_OUTPUT = True
+USE_JUDGMENT_CACHE = True
+USE_LOCAL_JUDGE = True
+PACKED_LOG_DIR = "../../../logs/packed"
+
+# A judge with at most this many pending pairs (across all CSVs) uses real-time calls instead of batch jobs;
+# 0 always uses batches.
+REALTIME_THRESHOLD = 500
+REALTIME_MAX_IN_FLIGHT = 16
+REALTIME_MAX_RETRIES = 3
+REALTIME_SHUTDOWN_GRACE = 30
+
+# Pairs per request; above 1, each request judges that many unrelated pairs and returns one judgment per
+# item. Items whose judgment does not parse are re-judged one pair per request.
+ITEMS_PER_REQUEST = 1
+# With multi-item requests, re-judge this many random pairs one per request and report the agreement
+# and token savings in multi_item_agreement.json; 0 skips the check.
+MULTI_ITEM_CHECK_SAMPLE = 0
+MULTI_ITEM_CHECK_SEED = 0
+# Listwise judging: the pending answers of all input CSVs to the same question and reference go into one
+# request (at most LISTWISE_MAX_ANSWERS answers, in a random order), each with its own rating.
+LISTWISE = False
+LISTWISE_MAX_ANSWERS = 16
+
+BATCH_FIELDNAMES = ['QA_Pair_ID', 'Question', 'Model_Answer', 'Reference_Answer', 'Judge_Rating', 'Judge_Reason',
+                   'Judge_Source']
+
+BACKENDS = {
+    'claude': ('judge_claude', 'ClaudeBackend'),
+    'gemini': ('judge_gemini', 'GeminiBackend'),
+    'openai': ('judge_gpt4o', 'OpenAIBackend'),
+    'local': ('judge_local', 'LocalBackend'),
+}
+DEFAULT_JUDGES = ['claude', 'gemini', 'openai']
+
+# Cascade order, cheapest batch pricing first; the last judge only sees pairs the first two disagree on.
+CASCADE_ORDER = ['gemini', 'openai', 'claude']
+
+
+def empty_token_usage():
+    return {'input_tokens': 0, 'cached_input_tokens': 0, 'output_tokens': 0, 'total_tokens': 0}
+
+
+def failed_results(qa_pairs, reason):
+    """Mark every pair of a batch as failed with the same reason, keyed by custom ID."""
+    return {qa['custom_id']: {'rating': -1, 'reason': reason} for qa in qa_pairs}
+
+
+def structured_judgment(payload, text):
+    """Return a result if payload is a schema-valid judgment ({"rating": 1-4, "reason": str}), else None."""
+    if not isinstance(payload, dict):
+        return None
+    rating = payload.get('rating')
+    reason = payload.get('reason')
+    if isinstance(rating, bool) or not isinstance(rating, int) or not 1 <= rating <= 4 or not isinstance(reason, str):
+        return None
+    return {'rating': rating, 'reason': reason, 'text': text}
+
+
+def strip_code_fence(text):
+    """Remove a Markdown code fence around a reply, if there is one."""
+    if text.startswith('```'):
+        lines = text.split('\n')
+        if lines[0].startswith('```'):
+            lines = lines[1:]
+        if lines and lines[-1].strip() == '```':
+            lines = lines[:-1]
+        text = '\n'.join(lines).strip()
+    return text
+
+
+def parse_judge_response(text):
+    """Extract rating and reason from a judge reply.
+
+    Schema-constrained replies parse directly; stripping code fences, searching for the JSON object and
+    escaping stray backslashes is only a fallback for free-form replies. 'text' is always the reply as
+    received, so multi-item replies can be split with split_multi_result.
+    """
+    text = (text or '').strip()
+    reply = text
+
+    try:
+        result = structured_judgment(json.loads(text), text)
+        if result:
+            return result
+    except ValueError:
+        pass
+
+    text = strip_code_fence(text)
+
+    try:
+        json_match = re.search(r'\{[^{}]*"rating"[^{}]*"reason"[^{}]*\}', text)
+        if json_match:
+            text = json_match.group(0)
+
+        text = re.sub(r'\\(?!["\\/bfnrtu])', r'\\\\', text)
+
+        response_json = json.loads(text)
+        return {
+            'rating': response_json.get('rating', -1),
+            'reason': response_json.get('reason', 'Parse error'),
+            'text': reply
+        }
+    except Exception as e:
+        return {'rating': -1, 'reason': f'JSON parse error: {e} (text={text if text else "EMPTY"})', 'text': reply}
+
+
+def multi_item_request(qa_pairs, listwise=False):
+    """A request unit judging several pairs at once; its custom ID is a stable hash of theirs.
+
+    A listwise unit holds answers to the same question and reference, which are sent only once.
+    """
+    digest = hashlib.sha256('\n'.join(qa['custom_id'] for qa in qa_pairs).encode('utf-8')).hexdigest()[:32]
+    if listwise:
+        return {'custom_id': f"list_{digest}", 'items': qa_pairs, 'listwise': True}
+    return {'custom_id': f"multi_{digest}", 'items': qa_pairs}
+
+
+def listwise_requests(qa_pairs, max_answers):
+    """Group pairs by (question, reference) into listwise units of at most max_answers answers.
+
+    Answers are shuffled to spread position bias across models, with a seed derived from the question
+    and reference so a rerun builds the same requests. A question with a single pending answer is sent
+    as a plain single-item request.
+    """
+    groups = {}
+    for qa in qa_pairs:
+        groups.setdefault((qa['question'], qa['reference_answer']), []).append(qa)
+
+    units = []
+    for key, group in groups.items():
+        random.Random(hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()).shuffle(group)
+        size = math.ceil(len(group) / math.ceil(len(group) / max_answers))
+        for start in range(0, len(group), size):
+            chunk = group[start:start + size]
+            units.append(chunk[0] if len(chunk) == 1 else multi_item_request(chunk, listwise=True))
+    return units
+
+
+def request_items(qa):
+    """The pairs judged by one request: the items of a multi-item unit, else the pair itself."""
+    if 'items' in qa:
+        return [item for item in qa['items'] if item is not None]
+    return [qa]
+
+
+def token_shares(unit, result):
+    """{custom_id: token counts} sharing a multi-item or listwise request's tokens evenly among its items."""
+    num_items = len(unit['items'])
+    shares = {}
+    for number, item in enumerate(unit['items'], 1):
+        if item is None:
+            continue
+        shares[item['custom_id']] = {}
+        for key in ('input_tokens', 'cached_input_tokens', 'output_tokens'):
+            share, remainder = divmod(result.get(key, 0), num_items)
+            shares[item['custom_id']][key] = share + (1 if number <= remainder else 0)
+    return shares
+
+
+def request_prompt_template(qa):
+    """The judge prompt template a request is sent with: listwise, multi-item or single-item."""
+    if 'items' not in qa:
+        return JUDGE_PROMPT_TEMPLATE
+    return JUDGE_LISTWISE_PROMPT_TEMPLATE if qa.get('listwise') else JUDGE_MULTI_PROMPT_TEMPLATE
+
+
+def split_multi_result(unit, result):
+    """Split the result of a multi-item or listwise request into {custom_id: result} per item.
+
+    Items without exactly one schema-valid judgment are left out. Each item carries its token_shares
+    share, so per-pair totals stay comparable with single-item runs.
+    """
+    try:
+        judgments = json.loads(strip_code_fence((result.get('text') or '').strip()))['judgments']
+    except (ValueError, TypeError, KeyError):
+        return {}
+    if not isinstance(judgments, list):
+        return {}
+
+    by_number = {}
+    for judgment in judgments:
+        number = judgment.get('item') if isinstance(judgment, dict) else None
+        parsed = structured_judgment(judgment, json.dumps(judgment, ensure_ascii=False))
+        if isinstance(number, int) and parsed:
+            by_number.setdefault(number, []).append(parsed)
+
+    shares = token_shares(unit, result)
+    split = {}
+    for number, item in enumerate(unit['items'], 1):
+        if item is None or len(by_number.get(number, [])) != 1:
+            continue
+        split[item['custom_id']] = dict(by_number[number][0], **shares[item['custom_id']])
+    return split
+
+
+def batch_limits(backend_class):
+    """(max requests, max bytes) per batch: the backend's limits, lowered by any configured ceiling."""
+    max_requests = min(limit for limit in (backend_class.max_batch_requests, MAX_BATCH_REQUESTS, float('inf'))
+                       if limit)
+    max_bytes = min(limit for limit in (backend_class.max_batch_bytes, MAX_BATCH_BYTES, float('inf')) if limit)
+    return max_requests, max_bytes * BATCH_BYTES_HEADROOM
+
+
+def pack_batches(qa_pairs, request_size, max_requests, max_bytes):
+    """Greedily split qa_pairs, in order, into batches under both the request-count and byte limits."""
+    batches = []
+    current = []
+    current_bytes = 0
+    for qa in qa_pairs:
+        size = request_size(qa)
+        if current and (len(current) >= max_requests or current_bytes + size > max_bytes):
+            batches.append(current)
+            current = []
+            current_bytes = 0
+        current.append(qa)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def format_limit(max_requests, max_bytes):
+    requests_text = 'unlimited' if max_requests == float('inf') else f"{max_requests:,}"
+    bytes_text = 'unlimited' if max_bytes == float('inf') else f"{max_bytes / 1024**2:,.1f} MB"
+    return f"{requests_text} requests / {bytes_text}"
+
+
+def generate_qa_id_fallback(row_idx):
+    """Generate fallback QA ID from row index when missing from CSV."""
+    return f"qa_{row_idx:06d}"
+
+
+class JudgeBackend:
+    """Provider-specific part of a judge.
+
+    Subclasses set the class attributes and implement build_request, submit, poll_jobs, iter_results and
+    judge_realtime. Requests are identified by each pair's 'custom_id' (the QA ID tagged with its model),
+    and iter_results yields (custom_id, result) pairs as the provider's results are read, where result is
+    the dict from parse_judge_response (or a failure with rating -1) extended with that request's
+    'input_tokens' (all prompt tokens), 'cached_input_tokens' (those served from the provider's prompt
+    cache) and 'output_tokens'. judge_realtime returns the same dict for a single synchronous call.
+
+    With ITEMS_PER_REQUEST above 1 or LISTWISE, a request may instead be a multi-item or listwise unit
+    ({'custom_id', 'items'[, 'listwise']}); backends build it with system_prompt, format_prompt and
+    response_schema like any other request, and the engine splits its result per item.
+    """
+
+    name = None                 # output/{name}_judge/ and the {Name}_Judge_Rating column
+    title = None                # shown in logs
+    judge_model = None
+    api_key_env = None
+    log_name = None             # file name under logs/{input}/
+    max_active_batches = 20
+    max_queued_requests = None  # provider limit on requests across in-flight batch jobs; None means no limit
+    max_batch_requests = None   # provider limits per batch job; None means no limit
+    max_batch_bytes = None
+    realtime_requests_per_minute = 60   # rate limit for real-time calls of small workloads
+    realtime_max_in_flight = REALTIME_MAX_IN_FLIGHT
+    realtime_only = False               # True for backends without a batch API; every workload is real-time
+    default_api_key = None              # used when api_key_env is unset; None makes the key required
+
+    def __init__(self, api_key, run_id, logger):
+        self.api_key = api_key
+        self.run_id = run_id
+        self.logger = logger
+        self.structured_output = USE_STRUCTURED_OUTPUT
+
+    def log(self, message):
+        log_and_print(self.logger, message)
+
+    def prompt_fields(self, qa):
+        """Values of one pair for the judge input templates."""
+        return {
+            'question': qa['question'],
+            'teacher_a': qa['reference_answer'],
+            'model_a': qa['model_answer']
+        }
+
+    def format_prompt(self, qa):
+        """The per-request part of the prompt; backends send system_prompt ahead of it as a cacheable prefix."""
+        if qa.get('listwise'):
+            answers = [JUDGE_LISTWISE_ITEM_TEMPLATE.format(number=number, model_a=self.prompt_fields(item)['model_a'])
+                       for number, item in enumerate(qa['items'], 1)]
+            return "\n\n".join([JUDGE_LISTWISE_INPUT_TEMPLATE.format(**self.prompt_fields(qa['items'][0]))] + answers)
+        if 'items' in qa:
+            return "Given the following items:\n\n" + "\n\n".join(
+                JUDGE_ITEM_TEMPLATE.format(number=number, **self.prompt_fields(item))
+                for number, item in enumerate(qa['items'], 1)
+            )
+        return JUDGE_INPUT_TEMPLATE.format(**self.prompt_fields(qa))
+
+    def system_prompt(self, qa):
+        if qa.get('listwise'):
+            return JUDGE_LISTWISE_SYSTEM_PROMPT
+        return JUDGE_MULTI_SYSTEM_PROMPT if 'items' in qa else JUDGE_SYSTEM_PROMPT
+
+    def response_schema(self, qa):
+        """JSON schema of the structured reply to a request."""
+        return JUDGE_MULTI_RESPONSE_SCHEMA if 'items' in qa else JUDGE_RESPONSE_SCHEMA
+
+    def build_request(self, qa):
+        """The provider request for one pair, as serialized into the batch."""
+        raise NotImplementedError
+
+    def request_size(self, qa):
+        """Serialized size of one request in bytes, used to pack batches under max_batch_bytes."""
+        return len(json.dumps(self.build_request(qa)).encode('utf-8')) + 1
+
+    def submit(self, batch_num, qa_pairs):
+        """Create a batch job for qa_pairs; returns a job dict with 'id' and 'state', None on failure, or
+        'requeue' if the provider rejected it for a rate or queue limit and it should be resubmitted later."""
+        raise NotImplementedError
+
+    def poll_jobs(self, jobs):
+        """Refresh jobs in place; returns {job_id: 'running' | 'done' | 'requeue'}."""
+        raise NotImplementedError
+
+    def iter_results(self, job, qa_pairs):
+        """Stream and parse the results of a finished job, yielding (custom_id, result).
+
+        Raises if the results cannot be read completely, so the job stays in the ledger for the next run.
+        """
+        raise NotImplementedError
+
+    def judge_realtime(self, qa):
+        """Judge one pair with a synchronous API call and return its result; raises on request errors."""
+        raise NotImplementedError
+
+
+class BatchOutputWriter:
+    """Write one batch's results to its CSV and token-analysis sink as they are parsed.
+
+    Response texts go straight to disk; only ratings and reasons are kept for the judgment cache and the
+    judged-ID index. The CSV is written under a temporary name and renamed on close, so an interrupted
+    download never leaves a partial batch file behind; discard drops both files instead.
+    """
+
+    def __init__(self, output_dir, batch_num, judged_index_file, token_analysis=None, prompt_template=None):
+        self.output_file = os.path.join(output_dir, f"batch_{batch_num:04d}.csv")
+        self.judged_index_file = judged_index_file
+        self.csv_file = open(f"{self.output_file}.tmp", 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.csv_file, fieldnames=BATCH_FIELDNAMES, quoting=csv.QUOTE_NONNUMERIC)
+        self.writer.writeheader()
+        self.token_analysis = token_analysis
+        self.prompt_template = prompt_template
+
+        self.qa_pairs = []
+        self.results = {}
+        self.token_usage = empty_token_usage()
+
+    def add(self, qa, result):
+        self.writer.writerow({
+            'QA_Pair_ID': qa['id'],
+            'Question': qa['question'],
+            'Model_Answer': qa['model_answer'],
+            'Reference_Answer': qa['reference_answer'],
+            'Judge_Rating': result['rating'],
+            'Judge_Reason': result['reason'],
+            'Judge_Source': result.get('source', 'batch')
+        })
+        self.qa_pairs.append(qa)
+        self.results[qa['id']] = {key: result[key] for key in ('rating', 'reason', 'source') if key in result}
+
+        input_tokens = result.get('input_tokens', 0)
+        output_tokens = result.get('output_tokens', 0)
+        self.token_usage['input_tokens'] += input_tokens
+        self.token_usage['cached_input_tokens'] += result.get('cached_input_tokens', 0)
+        self.token_usage['output_tokens'] += output_tokens
+        self.token_usage['total_tokens'] += input_tokens + output_tokens
+
+        if self.token_analysis:
+            self.token_analysis.add(qa['id'], result)
+
+    def close(self):
+        """Finish both files, index the judged IDs and return (results, token_usage)."""
+        self.csv_file.close()
+        os.replace(f"{self.output_file}.tmp", self.output_file)
+        record_judged_ids(self.judged_index_file, [
+            {'QA_Pair_ID': qa_id, 'Judge_Rating': result['rating']} for qa_id, result in self.results.items()
+        ])
+
+        if self.token_analysis:
+            self.token_analysis.close()
+
+        return self.results, self.token_usage
+
+    def discard(self):
+        """Drop a batch whose results could not be read completely, without indexing any of its pairs."""
+        self.csv_file.close()
+        os.remove(f"{self.output_file}.tmp")
+        if self.token_analysis:
+            self.token_analysis.discard()
+
+
+class JudgeRun:
+    """Judging of one input CSV (and sample column) with one backend."""
+
+    def __init__(self, backend_class, input_file, sample_index, skip_ids=None):
+        self.backend_class = backend_class
+        self.input_file = input_file
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        input_basename = os.path.basename(input_file).replace('.csv', '')
+        self.judge_basename = input_basename if sample_index == 1 else f"{input_basename}_sample_{sample_index}"
+        judge_dir = f"../../../output/{backend_class.name}_judge/{self.judge_basename}"
+        self.judge_dir = judge_dir
+        self.skip_ids = skip_ids or set()
+        # The cache is looked up under the prompt of this run's mode. Results are cached and analysed
+        # under the prompt of the request that judged them (request_prompt_template), so fallback rounds
+        # and single pairs of a grouped run land under the single-item prompt.
+        if LISTWISE:
+            self.prompt_template = JUDGE_LISTWISE_PROMPT_TEMPLATE
+        elif ITEMS_PER_REQUEST > 1:
+            self.prompt_template = JUDGE_MULTI_PROMPT_TEMPLATE
+        else:
+            self.prompt_template = JUDGE_PROMPT_TEMPLATE
+        self.answer_column = f"Model Answer{sample_suffix(sample_index)}"
+        self.rating_column = f"{backend_class.name.title()}_Judge_Rating{sample_suffix(sample_index)}"
+        self.output_dir = f"{judge_dir}/{self.run_id}"
+        self.ledger_file = f"{judge_dir}/batch_ledger.json"
+        self.judged_index_file = f"{judge_dir}/judged_ids.sqlite"
+        self.log_dir = f"../../../logs/{input_basename}"
+        self.log_file = f"{self.log_dir}/{backend_class.log_name}"
+
+        self.logger = None
+        self.ledger = None
+        self.cache = None
+        self.pending = []
+        self.reattached = []
+        self.has_work = False
+        self.next_batch_num = 1
+        self.local_count = 0
+        self.cache_count = 0
+
+    def log(self, message):
+        log_and_print(self.logger, message)
+
+    def collect_qa_pairs(self, data, judged_ids):
+        """Return the pairs of the answer column that are neither judged in a batch file nor in the CSV.
+
+        Pairs in skip_ids (settled by the first judges of a cascade) are left out as well.
+        """
+        qa_pairs = []
+        skipped_from_csv = 0
+        skipped_by_cascade = 0
+
+        for row_idx, row in enumerate(data):
+            qa_id = row.get('QA_Pair_ID', '').strip()
+            if not qa_id:
+                qa_id = generate_qa_id_fallback(row_idx)
+                self.log(f"  Warning: Row {row_idx} missing QA_Pair_ID, using fallback: {qa_id}")
+
+            if qa_id in judged_ids:
+                continue
+
+            if qa_id in self.skip_ids:
+                skipped_by_cascade += 1
+                continue
+
+            existing_rating = str(row.get(self.rating_column, '')).strip()
+            try:
+                rating_val = float(existing_rating) if existing_rating else -1
+                if rating_val >= 1 and rating_val <= 4:
+                    skipped_from_csv += 1
+                    continue
+            except (ValueError, TypeError):
+                pass
+
+            question = row.get('Question', '').strip()
+            model_answer = row.get(self.answer_column, '').strip()
+            reference_answer = row.get('Reference Answer', '').strip()
+
+            if question and model_answer and reference_answer:
+                qa_pairs.append({
+                    'id': qa_id,
+                    'custom_id': f"{self.judge_basename}::{qa_id}",
+                    'question': question,
+                    'model_answer': model_answer,
+                    'reference_answer': reference_answer
+                })
+
+        self.log(f"Found {len(qa_pairs)} QA pairs to judge")
+        self.log(f"Skipped {len(judged_ids)} already-judged pairs (from batch files)")
+        self.log(f"Skipped {skipped_from_csv} already-judged pairs (from input CSV)")
+        if self.skip_ids:
+            self.log(f"Skipped {skipped_by_cascade} pairs the first two judges agree on (cascade)")
+        return qa_pairs
+
+    def load_ratings(self, data):
+        """Return {qa_id: rating} of this judge for the CSV, from its rating column and every batch file."""
+        ratings = {}
+        for row in data:
+            if is_valid_rating(row.get(self.rating_column, '')):
+                ratings[row.get('QA_Pair_ID', '').strip()] = int(float(row[self.rating_column]))
+
+        for batch_file in sorted(glob(os.path.join(self.judge_dir, "*", "batch_*.csv"))):
+            for row in read_csv_as_dicts(batch_file):
+                if is_valid_rating(row['Judge_Rating']):
+                    ratings[row['QA_Pair_ID']] = int(float(row['Judge_Rating']))
+        return ratings
+
+    def claim_output_dir(self):
+        """Create this run's output directory, suffixing run_id with a counter when another process judging
+        the same CSV (e.g. run_pipeline.py micro-batches) started within the same second."""
+        os.makedirs(self.judge_dir, exist_ok=True)
+        base_run_id = self.run_id
+        for attempt in itertools.count(2):
+            try:
+                os.mkdir(self.output_dir)
+                return
+            except FileExistsError:
+                self.run_id = f"{base_run_id}_{attempt}"
+                self.output_dir = f"{self.judge_dir}/{self.run_id}"
+
+    def prepare(self):
+        """Load the CSV, reattach to unfinished jobs and write local and cached judgments.
+
+        Leaves the pairs that still need a provider batch in self.pending; returns False when there is
+        nothing left to do for this CSV.
+        """
+        self.claim_output_dir()
+        os.makedirs(self.log_dir, exist_ok=True)
+
+        backend_class = self.backend_class
+        self.logger = setup_logger(self.log_file)
+        self.log("="*80)
+        self.log(f"{backend_class.title} Judge")
+        self.log(f"Input: {self.input_file}")
+        self.log(f"Answer Column: {self.answer_column}")
+        self.log(f"Judge Model: {backend_class.judge_model}")
+        self.log(f"Output Directory: {self.output_dir}")
+        self.log(f"Batch Limits: {format_limit(*batch_limits(backend_class))}")
+        if LISTWISE:
+            self.log(f"Listwise: up to {LISTWISE_MAX_ANSWERS} answers per question across all input CSVs")
+        elif ITEMS_PER_REQUEST > 1:
+            self.log(f"Items Per Request: {ITEMS_PER_REQUEST}")
+        self.log("="*80)
+
+        self.log("\nLoading input file...")
+        data = read_csv_as_dicts(self.input_file)
+        self.log(f"Loaded {len(data)} rows from CSV")
+
+        self.log("\nChecking for existing judgments...")
+        judged_ids = load_judged_ids(self.judged_index_file, self.logger)
+
+        self.log("\nCollecting QA pairs to judge...")
+        qa_pairs = self.collect_qa_pairs(data, judged_ids)
+
+        self.ledger = BatchLedger(self.ledger_file, backend_class.name, backend_class.judge_model)
+        self.reattached, qa_pairs = reattach_batches(self.ledger, qa_pairs, judged_ids, self.logger)
+        if self.reattached:
+            self.log(f"Reattached to {len(self.reattached)} unfinished batch job(s) from {self.ledger_file}")
+
+        prejudged = local_judgments(qa_pairs) if USE_LOCAL_JUDGE else {}
+        self.local_count = len(prejudged)
+        if USE_LOCAL_JUDGE:
+            self.log(f"Judged {self.local_count} pairs locally (exact or numerically equivalent answers)")
+
+        if USE_JUDGMENT_CACHE:
+            self.cache = JudgmentCache(CACHE_FILE, backend_class.judge_model, self.prompt_template)
+            prejudged.update(self.cache.lookup([qa for qa in qa_pairs if qa['id'] not in prejudged]))
+            self.cache_count = len(prejudged) - self.local_count
+            self.log(f"Found {self.cache_count} pairs in the judgment cache")
+
+        prejudged_pairs = [qa for qa in qa_pairs if qa['id'] in prejudged]
+        self.pending = [qa for qa in qa_pairs if qa['id'] not in prejudged]
+
+        if not self.pending and not self.reattached and not prejudged_pairs:
+            self.log("\nNo new pairs to judge - all done!")
+            self.log("="*80)
+            return False
+
+        self.has_work = True
+        self.next_batch_num = len(glob(os.path.join(self.output_dir, "batch_*.csv"))) + 1
+        if prejudged_pairs:
+            writer = self.open_writer(token_analysis=False)
+            for qa in prejudged_pairs:
+                writer.add(qa, prejudged[qa['id']])
+            writer.close()
+            self.log(f"  Written {len(prejudged_pairs)} results to {writer.output_file}")
+
+        return True
+
+    def open_writer(self, prompt_template=None, token_analysis=True):
+        """Start this run's next batch file, for results of requests sent with prompt_template."""
+        prompt_template = prompt_template or self.prompt_template
+        sink = None
+        if token_analysis:
+            sink = TokenAnalysisWriter(self.output_dir, self.next_batch_num, self.backend_class.judge_model,
+                                       prompt_template)
+        writer = BatchOutputWriter(self.output_dir, self.next_batch_num, self.judged_index_file, sink,
+                                   prompt_template)
+        self.next_batch_num += 1
+        return writer
+
+    def finish_batch(self, writer, token_analysis=True):
+        """Close a batch file written from provider results, then update stats and the judgment cache."""
+        results, token_usage = writer.close()
+
+        if self.cache:
+            self.cache.store(writer.qa_pairs, results, writer.prompt_template)
+
+        success_count = sum(1 for r in results.values() if r['rating'] != -1)
+        self.log(f"  Completed: {success_count} success, {len(results)-success_count} errors")
+        self.log(f"  Token Usage - Input: {token_usage['input_tokens']:,} ({token_usage['cached_input_tokens']:,} cached), "
+                 f"Output: {token_usage['output_tokens']:,}, Total: {token_usage['total_tokens']:,}")
+        self.log(f"  Written {len(results)} results to {writer.output_file}")
+        if token_analysis:
+            self.log(f"  Token analysis saved to {self.output_dir}/token_analysis/")
+        return results, token_usage
+
+    def save_token_summary(self):
+        """Compute the run's token usage from its token-analysis files and save the summary."""
+        summary = summarize_token_analysis(self.output_dir)
+        with open(os.path.join(self.output_dir, "token_usage_summary.json"), 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    def finish(self):
+        """Log the final stats and write the token summary."""
+        self.log("\n" + "="*80)
+        if shutdown_requested():
+            self.log(f"Judging stopped early; in-flight batches are in {self.ledger_file} and will be reattached on the next run")
+        else:
+            self.log("Judging complete!")
+        self.log(f"Results written to: {self.output_dir}")
+        self.log("")
+        self.log("Stats:")
+        self.log(f"  Local matches: {self.local_count:,}")
+        self.log(f"  Cache hits:    {self.cache_count:,}")
+
+        token_usage = self.save_token_summary()['token_usage']
+        self.log(f"  Input tokens:  {token_usage['input_tokens']:,} ({token_usage['cached_input_tokens']:,} cached)")
+        self.log(f"  Output tokens: {token_usage['output_tokens']:,}")
+        self.log(f"  Total tokens:  {token_usage['total_tokens']:,}")
+        self.log(f"\nToken summary saved to: {self.output_dir}/token_usage_summary.json")
+
+        # A full run after a cascade fills the rest of the rating column, so its scores are comparable again.
+        marker = os.path.join(self.judge_dir, CASCADE_MARKER)
+        if not self.skip_ids and not shutdown_requested() and os.path.exists(marker):
+            os.remove(marker)
+            self.log(f"Removed {marker}: this judge now covers every pair, not only a cascade's disagreements")
+        self.log("="*80)
+
+
+class PackedJudge:
+    """All runs of one backend, packed into shared provider batches and demultiplexed on collection.
+
+    Also acts as the lane's ledger: a job is recorded in the ledger of every model it contains pairs of.
+    With ITEMS_PER_REQUEST above 1 or LISTWISE the lane's requests are multi-item or listwise units; their
+    results are split per pair, and pairs whose judgment does not parse are kept in self.fallback for
+    single-item judging.
+    """
+
+    def __init__(self, backend_class, runs, api_key):
+        self.backend_class = backend_class
+        self.runs = runs
+        self.run_of = {qa['custom_id']: run for run in runs for qa in run.pending}
+        for run in runs:
+            for batch_qa_pairs, job in run.reattached:
+                self.run_of.update((qa['custom_id'], run) for qa in batch_qa_pairs)
+
+        if len(runs) == 1:
+            self.logger = runs[0].logger
+            self.path = runs[0].ledger_file
+        else:
+            os.makedirs(PACKED_LOG_DIR, exist_ok=True)
+            self.logger = setup_logger(f"{PACKED_LOG_DIR}/{backend_class.log_name}")
+            self.path = f"the batch_ledger.json of {len(runs)} models"
+        self.backend = backend_class(api_key, runs[0].run_id, self.logger)
+
+        self.items_per_request = ITEMS_PER_REQUEST
+        self.listwise = LISTWISE
+        self.fallback = []
+        self.check_pairs = []
+        self.check_results = {}
+        if (self.listwise or self.items_per_request > 1) and MULTI_ITEM_CHECK_SAMPLE:
+            pending = [qa for run in runs for qa in run.pending]
+            self.check_pairs = random.Random(MULTI_ITEM_CHECK_SEED).sample(
+                pending, min(MULTI_ITEM_CHECK_SAMPLE, len(pending)))
+        self.check_ids = {qa['custom_id'] for qa in self.check_pairs}
+
+    def log(self, message):
+        log_and_print(self.logger, message)
+
+    def log_header(self):
+        if len(self.runs) > 1:
+            self.log("="*80)
+            self.log(f"{self.backend_class.title} Judge (packed)")
+            self.log(f"Models: {', '.join(run.judge_basename for run in self.runs)}")
+            self.log("="*80)
+
+    def group(self, qa_pairs):
+        """Split a packed batch into {run: pairs of that run}."""
+        groups = {}
+        for unit in qa_pairs:
+            for qa in request_items(unit):
+                groups.setdefault(self.run_of[qa['custom_id']], []).append(qa)
+        return groups
+
+    def record(self, job_id, batch_num, qa_pairs, output_dir):
+        # Multi-item jobs also record which pairs each request holds, so a reattached job can be split again.
+        units = {unit['custom_id']: [qa['custom_id'] for qa in unit['items']] for unit in qa_pairs if 'items' in unit}
+        for run, run_pairs in self.group(qa_pairs).items():
+            run.ledger.record(job_id, batch_num, run_pairs, run.output_dir, units or None)
+
+    def update(self, job_id, status):
+        for run in self.runs:
+            if any(entry['job_id'] == job_id for entry in run.ledger.entries):
+                run.ledger.update(job_id, status)
+
+    def request_units(self, qa_pairs):
+        """Group pairs into listwise requests, or, in order, into requests of items_per_request pairs."""
+        if self.listwise:
+            return listwise_requests(qa_pairs, LISTWISE_MAX_ANSWERS)
+        if self.items_per_request <= 1:
+            return qa_pairs
+        chunks = [qa_pairs[i:i + self.items_per_request] for i in range(0, len(qa_pairs), self.items_per_request)]
+        return [chunk[0] if len(chunk) == 1 else multi_item_request(chunk) for chunk in chunks]
+
+    @staticmethod
+    def reattached_units(batch_qa_pairs, job):
+        """Rebuild the requests of a reattached job; pairs of its multi-item requests that are no longer
+        pending stay as None so the remaining items keep their numbers. Listwise units are recognised by
+        the list_ prefix multi_item_request gives their custom ID."""
+        if not job.get('units'):
+            return batch_qa_pairs
+        pairs_by_custom_id = {qa['custom_id']: qa for qa in batch_qa_pairs}
+        units = []
+        for unit_id, custom_ids in job['units'].items():
+            unit = {'custom_id': unit_id, 'items': [pairs_by_custom_id.pop(custom_id, None) for custom_id in custom_ids]}
+            if unit_id.startswith('list_'):
+                unit['listwise'] = True
+            units.append(unit)
+        return [unit for unit in units if request_items(unit)] + list(pairs_by_custom_id.values())
+
+    def describe_units(self, units):
+        """How the pairs are grouped into requests, for the packing log line."""
+        if self.listwise:
+            return f", listwise in {len(units):,} requests"
+        if self.items_per_request > 1:
+            return f", {self.items_per_request} per request"
+        return ""
+
+    def build_lane(self):
+        """Pack the pending pairs of every run into batches and return the lane that runs them."""
+        # A packed job is in the ledger of each model it covers; reattach it once with all of its pairs.
+        reattached_jobs = {}
+        for run in self.runs:
+            for batch_qa_pairs, job in run.reattached:
+                reattached_jobs.setdefault(job['id'], (job, []))[1].extend(batch_qa_pairs)
+            run.reattached = []
+        reattached = [(i + 1, self.reattached_units(batch_qa_pairs, job), job)
+                      for i, (job, batch_qa_pairs) in enumerate(reattached_jobs.values())]
+
+        qa_pairs = [qa for run in self.runs for qa in run.pending]
+        for run in self.runs:
+            run.pending = []
+        units = self.request_units(qa_pairs)
+        max_requests, max_bytes = batch_limits(self.backend_class)
+        packed = pack_batches(units, self.backend.request_size, max_requests, max_bytes)
+        batches = [(len(reattached) + 1 + batch_idx, batch_qa_pairs) for batch_idx, batch_qa_pairs in enumerate(packed)]
+        num_batches = len(batches)
+
+        self.log_header()
+        self.log(f"\nPacking {len(qa_pairs)} pairs from {len(self.runs)} model(s){self.describe_units(units)} "
+                 f"into {num_batches} batch(es) ({format_limit(max_requests, max_bytes)}), "
+                 f"up to {self.backend_class.max_active_batches} in flight...")
+
+        return BatchLane(
+            self.backend_class.name,
+            batches,
+            submit=self.backend.submit,
+            poll_jobs=self.backend.poll_jobs,
+            collect=self.collect,
+            on_complete=self.on_complete,
+            max_active=self.backend_class.max_active_batches,
+            ledger=self,
+            output_dir=None,
+            logger=self.logger,
+            reattached=reattached,
+            max_requests=self.backend_class.max_queued_requests
+        )
+
+    def run_realtime(self, qa_pairs, on_result):
+        """Send each request with concurrent, rate-limited, retried real-time calls.
+
+        on_result(qa, result) is called from this thread as results arrive. Requests still unanswered
+        when a shutdown is requested are abandoned after REALTIME_SHUTDOWN_GRACE.
+        """
+        rate_limiter = RateLimiter(self.backend_class.realtime_requests_per_minute)
+        max_in_flight = self.backend_class.realtime_max_in_flight
+
+        def judge(qa):
+            for attempt in range(1, REALTIME_MAX_RETRIES + 1):
+                rate_limiter.wait()
+                try:
+                    return self.backend.judge_realtime(qa)
+                except Exception as e:
+                    if attempt == REALTIME_MAX_RETRIES or shutdown_requested():
+                        return {'rating': -1, 'reason': f'Real-time request failed: {e}'}
+                    time.sleep(2 ** attempt)
+
+        pending = iter(qa_pairs)
+        in_flight = {}
+
+        def record_results(done):
+            for future in done:
+                on_result(in_flight.pop(future), future.result())
+
+        # Daemon workers: requests abandoned after the grace period must not hold up the process's exit.
+        executor = DaemonThreadPool(max_in_flight)
+        try:
+            while True:
+                while len(in_flight) < max_in_flight and not shutdown_requested():
+                    qa = next(pending, None)
+                    if qa is None:
+                        break
+                    in_flight[executor.submit(judge, qa)] = qa
+
+                if shutdown_requested():
+                    self.log(f"Shutdown requested, waiting up to {REALTIME_SHUTDOWN_GRACE}s for "
+                             f"{len(in_flight)} in-flight requests")
+                    done, _ = wait(in_flight, timeout=REALTIME_SHUTDOWN_GRACE)
+                    record_results(done)
+                    if in_flight:
+                        self.log(f"Abandoning {len(in_flight)} unfinished requests; they will be judged on the next run")
+                    break
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, timeout=1, return_when=FIRST_COMPLETED)
+                record_results(done)
+        finally:
+            executor.shutdown()
+
+    def judge_realtime(self):
+        """Judge every pending pair with concurrent real-time calls and write one batch file per model.
+
+        Pairs still unanswered when a shutdown is requested are left unjudged for the next run.
+        """
+        qa_pairs = [qa for run in self.runs for qa in run.pending]
+        for run in self.runs:
+            run.pending = []
+        units = self.request_units(qa_pairs)
+
+        self.log_header()
+        self.log(f"\nJudging {len(qa_pairs)} pairs from {len(self.runs)} model(s) in real time"
+                 f"{self.describe_units(units)}, up to {self.backend_class.realtime_max_in_flight} in flight at "
+                 f"{self.backend_class.realtime_requests_per_minute:,} requests/min...")
+
+        writers = {}
+        try:
+            self.run_realtime(units, lambda qa, result: self.write_result(writers, qa, dict(result, source='realtime')))
+        finally:
+            for (run, _), writer in writers.items():
+                run.log("\n--- Real-time batch finished ---")
+                run.finish_batch(writer)
+
+    def write_result(self, writers, qa, result):
+        """Add a request's result to the batch file of its model and request prompt, opening the file on
+        first use.
+
+        A multi-item result is split per pair first; pairs without a judgment go to self.fallback and
+        carry their share of the request's tokens, which is added to their single-item result so the
+        token analysis still accounts for the whole request.
+        """
+        if 'items' in qa:
+            split = split_multi_result(qa, result)
+            shares = token_shares(qa, result)
+            items = []
+            for item in request_items(qa):
+                if item['custom_id'] in split:
+                    item_result = split[item['custom_id']]
+                    if 'source' in result:
+                        item_result['source'] = result['source']
+                    items.append((item, item_result))
+                    if item['custom_id'] in self.check_ids:
+                        self.check_results[item['custom_id']] = item_result
+                else:
+                    item['unparsed_tokens'] = shares[item['custom_id']]
+                    self.fallback.append(item)
+        else:
+            unparsed_tokens = qa.get('unparsed_tokens', {})
+            items = [(qa, dict(result, **{key: result.get(key, 0) + count
+                                          for key, count in unparsed_tokens.items()}))]
+
+        prompt_template = request_prompt_template(qa)
+        for item, item_result in items:
+            key = (self.run_of[item['custom_id']], prompt_template)
+            if key not in writers:
+                writers[key] = key[0].open_writer(prompt_template)
+            writers[key].add(item, item_result)
+
+    def collect(self, batch_num, job, qa_pairs):
+        """Stream a finished job's results into the batch CSV and token analysis of each model it covers.
+
+        job is None when submission failed; every pair of the batch is then written as failed. If reading
+        the results fails partway, the job's files are discarded and the error re-raised, so the lane
+        leaves the job submitted in the ledger instead of writing the unread pairs as missing.
+        """
+        pairs_by_custom_id = {qa['custom_id']: qa for qa in qa_pairs}
+        if job is None:
+            stream = failed_results(qa_pairs, 'Batch submission failed').items()
+        else:
+            stream = self.backend.iter_results(job, qa_pairs)
+
+        writers = {}
+        ignored = 0
+        fallback_count = len(self.fallback)
+        try:
+            for custom_id, result in stream:
+                qa = pairs_by_custom_id.pop(custom_id, None)
+                if qa is None:
+                    ignored += 1
+                    continue
+                self.write_result(writers, qa, result)
+        except Exception:
+            for writer in writers.values():
+                writer.discard()
+            del self.fallback[fallback_count:]
+            for unit in qa_pairs:
+                for item in request_items(unit):
+                    self.check_results.pop(item['custom_id'], None)
+            raise
+
+        for qa in pairs_by_custom_id.values():
+            self.write_result(writers, qa, {'rating': -1, 'reason': 'Missing response'})
+
+        if ignored:
+            self.log(f"  Ignored {ignored} result(s) for pairs not in this batch (re-judged or duplicate IDs)")
+
+        results = {}
+        token_usage = empty_token_usage()
+        for (run, _), writer in writers.items():
+            if len(self.runs) > 1:
+                run.log(f"\n--- Packed batch {batch_num} finished ({job['id'] if job else 'not submitted'}) ---")
+            run_results, run_usage = run.finish_batch(writer, token_analysis=job is not None)
+            results.update((qa['custom_id'], run_results[qa['id']]) for qa in writer.qa_pairs)
+            for key in token_usage:
+                token_usage[key] += run_usage[key]
+        return results, token_usage
+
+    def on_complete(self, batch_num, qa_pairs, results, token_usage):
+        if len(self.runs) > 1:
+            self.log(f"  Demultiplexed {len(results)} results to {len(self.group(qa_pairs))} model(s); "
+                     f"tokens: {token_usage['total_tokens']:,}")
+
+    def requeue_fallback(self):
+        """Return the pairs whose multi-item or listwise judgment did not parse to their runs, to be judged
+        one per request; returns how many there were."""
+        fallback, self.fallback = self.fallback, []
+        self.items_per_request = 1
+        self.listwise = False
+        for qa in fallback:
+            self.run_of[qa['custom_id']].pending.append(qa)
+        if fallback:
+            self.log(f"\nRe-judging {len(fallback)} pairs whose grouped judgment did not parse, one per request...")
+        return len(fallback)
+
+    def check_agreement(self):
+        """Re-judge the sampled pairs one per request and report how often they agree with their
+        multi-item or listwise judgments, and the tokens per pair of both, in each run's
+        multi_item_agreement.json."""
+        sample = [qa for qa in self.check_pairs if qa['custom_id'] in self.check_results]
+        if not sample:
+            return
+        self.log(f"\nChecking agreement with single-item judging: re-judging {len(sample)} sampled pairs...")
+        single_results = {}
+        self.run_realtime(sample, lambda qa, result: single_results.__setitem__(qa['custom_id'], result))
+
+        compared = []
+        for qa in sample:
+            multi = self.check_results[qa['custom_id']]
+            single = single_results.get(qa['custom_id'])
+            if single and is_valid_rating(single['rating']):
+                compared.append((multi, single))
+
+        def tokens_per_pair(results):
+            usage = empty_token_usage()
+            for result in results:
+                for key in ('input_tokens', 'cached_input_tokens', 'output_tokens'):
+                    usage[key] += result.get(key, 0)
+            usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
+            return {key: round(value / len(results), 2) if results else 0 for key, value in usage.items()}
+
+        multi_tokens = tokens_per_pair([multi for multi, _ in compared])
+        single_tokens = tokens_per_pair([single for _, single in compared])
+        report = {
+            'timestamp': datetime.now().isoformat(),
+            'judge_model': self.backend_class.judge_model,
+            'models': [run.judge_basename for run in self.runs],
+            'items_per_request': ITEMS_PER_REQUEST,
+            'listwise': LISTWISE,
+            'sampled_pairs': len(sample),
+            'compared_pairs': len(compared),
+            'exact_agreement': round(sum(1 for multi, single in compared if multi['rating'] == single['rating'])
+                                     / len(compared), 4) if compared else None,
+            'within_one_agreement': round(sum(1 for multi, single in compared
+                                              if abs(multi['rating'] - single['rating']) <= 1)
+                                          / len(compared), 4) if compared else None,
+            'multi_item_tokens_per_pair': multi_tokens,
+            'single_item_tokens_per_pair': single_tokens,
+            'token_savings': round(1 - multi_tokens['total_tokens'] / single_tokens['total_tokens'], 4)
+                             if single_tokens['total_tokens'] else None
+        }
+
+        self.log(f"  Compared {len(compared)} pairs: exact agreement {report['exact_agreement']}, "
+                 f"within one point {report['within_one_agreement']}")
+        self.log(f"  Tokens per pair: {multi_tokens['total_tokens']:,} grouped vs {single_tokens['total_tokens']:,} "
+                 f"single-item (savings: {report['token_savings']})")
+        for run in self.runs:
+            with open(os.path.join(run.output_dir, "multi_item_agreement.json"), 'w') as f:
+                json.dump(report, f, indent=2)
+        self.log("  Agreement report saved to multi_item_agreement.json in each model's run directory")
+
+
+def load_backend(name):
+    module_name, class_name = BACKENDS[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def start_judging(packed):
+    """Judge a backend's pending pairs in real time if the workload is small, and return the lane for the
+    rest (batches and reattached jobs), or None. Realtime-only backends never get a lane."""
+    num_pending = sum(len(run.pending) for run in packed.runs)
+    if num_pending and (packed.backend_class.realtime_only or num_pending <= REALTIME_THRESHOLD):
+        packed.judge_realtime()
+    if any(run.pending or run.reattached for run in packed.runs):
+        assert not packed.backend_class.realtime_only, f"{packed.backend_class.name} has no batch API"
+        return packed.build_lane()
+    return None
+
+
+def run_judges(backend_classes, input_files, sample_index=1, skip_ids=None):
+    """Judge every input file with every backend.
+
+    Each backend packs the pending pairs of all files into shared batches, and the batches of all
+    backends are polled together. A backend with at most REALTIME_THRESHOLD pending pairs judges them
+    with real-time calls first instead. skip_ids maps an input file to QA IDs that are not judged.
+
+    With multi-item or listwise requests, pairs whose judgment did not parse are judged one per request in
+    a second round, and the MULTI_ITEM_CHECK_SAMPLE agreement check runs last.
+    """
+    api_keys = {}
+    for backend_class in backend_classes:
+        api_keys[backend_class.name] = os.getenv(backend_class.api_key_env) or backend_class.default_api_key
+        if not api_keys[backend_class.name]:
+            print(f"ERROR: {backend_class.api_key_env} not found in environment")
+            sys.exit(1)
+
+    install_shutdown_handlers()
+    skip_ids = skip_ids or {}
+    runs = [JudgeRun(backend_class, input_file, sample_index, skip_ids.get(input_file))
+            for backend_class in backend_classes for input_file in input_files]
+    try:
+        packed_judges = []
+        for backend_class in backend_classes:
+            backend_runs = [run for run in runs if run.backend_class is backend_class and run.prepare()]
+            if any(run.pending or run.reattached for run in backend_runs):
+                packed_judges.append(PackedJudge(backend_class, backend_runs, api_keys[backend_class.name]))
+
+        run_concurrent_batches([lane for lane in map(start_judging, packed_judges) if lane])
+        if not shutdown_requested():
+            fallback = [packed for packed in packed_judges if packed.requeue_fallback()]
+            run_concurrent_batches([lane for lane in map(start_judging, fallback) if lane])
+        if not shutdown_requested():
+            for packed in packed_judges:
+                packed.check_agreement()
+        for run in runs:
+            if run.has_work:
+                run.finish()
+    except Exception as e:
+        for run in runs:
+            logger = run.logger or setup_logger(run.log_file)
+            log_and_print(logger, "\n" + "="*80)
+            log_and_print(logger, "Fatal Error")
+            log_and_print(logger, "="*80)
+            log_and_print(logger, f"Error: {str(e)}")
+            log_and_print(logger, "\nFull traceback:")
+            log_and_print(logger, traceback.format_exc())
+            log_and_print(logger, "="*80)
+        sys.exit(1)
+
+
+def run_cascade(input_files, sample_index=1):
+    """Judge with the first two judges of CASCADE_ORDER, then with the third only where they disagree.
+
+    Where the first two agree on a valid rating, the third judge cannot change the majority vote, so it
+    only judges pairs with differing or failed ratings. Its rating column stays empty for the others, and
+    a CASCADE_MARKER in its output directory tells run_evaluation.py not to score it on its own.
+    """
+    first, second, third = (load_backend(name) for name in CASCADE_ORDER)
+    run_judges([first, second], input_files, sample_index)
+    if shutdown_requested():
+        return
+
+    skip_ids = {}
+    for input_file in input_files:
+        data = read_csv_as_dicts(input_file)
+        first_ratings = JudgeRun(first, input_file, sample_index).load_ratings(data)
+        second_ratings = JudgeRun(second, input_file, sample_index).load_ratings(data)
+        skip_ids[input_file] = {qa_id for qa_id, rating in first_ratings.items()
+                                if second_ratings.get(qa_id) == rating}
+        print(f"{input_file}: {first.title} and {second.title} agree on {len(skip_ids[input_file]):,} of {len(data):,} "
+              f"pairs; {third.title} judges the rest")
+
+        judge_dir = JudgeRun(third, input_file, sample_index).judge_dir
+        os.makedirs(judge_dir, exist_ok=True)
+        with open(os.path.join(judge_dir, CASCADE_MARKER), 'w') as f:
+            json.dump({'timestamp': datetime.now().isoformat(), 'first_judges': [first.name, second.name],
+                       'skipped_pairs': len(skip_ids[input_file])}, f, indent=2)
+
+    run_judges([third], input_files, sample_index, skip_ids)
+
+
+def main_for_backend(backend_class, script_name):
+    """Command-line entry point of a single-judge script: <exploded_csv_file> [sample_index]."""
+    if len(sys.argv) < 2:
+        print(f"Usage: python {script_name} <exploded_csv_file> [sample_index]")
+        sys.exit(1)
+    run_judges([backend_class], [sys.argv[1]], int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+
+
+def main():
+    global MAX_BATCH_REQUESTS, REALTIME_THRESHOLD, ITEMS_PER_REQUEST, MULTI_ITEM_CHECK_SAMPLE, LISTWISE, USE_JUDGMENT_CACHE
+    parser = argparse.ArgumentParser(description='Judge exploded CSVs with one or more batch judges')
+    parser.add_argument('input_files', nargs='+', help='Exploded CSVs with model answers; packed into shared batches')
+    parser.add_argument('--sample-index', type=int, default=1, help='Answer sample to judge (default: 1)')
+    parser.add_argument('--max-batch-requests', type=int,
+                        help='Ceiling on requests per batch below the provider limit (default: provider limit)')
+    parser.add_argument('--judges', nargs='+', default=DEFAULT_JUDGES, choices=list(BACKENDS),
+                        help=f'Judges to run (default: {" ".join(DEFAULT_JUDGES)})')
+    parser.add_argument('--cascade', action='store_true',
+                        help=f'Run {" and ".join(CASCADE_ORDER[:2])} first and {CASCADE_ORDER[2]} only on the pairs '
+                             f'they disagree on (ignores --judges)')
+    parser.add_argument('--realtime-threshold', type=int, default=REALTIME_THRESHOLD,
+                        help=f'Judge workloads of at most this many pending pairs with real-time calls instead of '
+                             f'batch jobs; 0 disables (default: {REALTIME_THRESHOLD})')
+    parser.add_argument('--items-per-request', type=int, default=ITEMS_PER_REQUEST,
+                        help=f'Judge this many unrelated pairs per request, with one judgment per pair; pairs whose '
+                             f'judgment does not parse are re-judged one per request (default: {ITEMS_PER_REQUEST})')
+    parser.add_argument('--listwise', action='store_true',
+                        help=f'Judge the answers of all input CSVs to the same question in one request per judge '
+                             f'(up to {LISTWISE_MAX_ANSWERS}, in random order), each rated on its own')
+    parser.add_argument('--multi-item-check', type=int, default=MULTI_ITEM_CHECK_SAMPLE, metavar='N',
+                        help='With --items-per-request above 1 or --listwise, re-judge N random pairs one per request '
+                             'and report agreement and token savings (default: off)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Send every pair to the judges instead of reusing ratings from the judgment cache')
+    args = parser.parse_args()
+    if args.listwise and args.items_per_request > 1:
+        parser.error("--listwise and --items-per-request are mutually exclusive")
+
+    MAX_BATCH_REQUESTS = args.max_batch_requests or MAX_BATCH_REQUESTS
+    REALTIME_THRESHOLD = args.realtime_threshold
+    ITEMS_PER_REQUEST = args.items_per_request
+    MULTI_ITEM_CHECK_SAMPLE = args.multi_item_check
+    LISTWISE = args.listwise
+    USE_JUDGMENT_CACHE = USE_JUDGMENT_CACHE and not args.no_cache
+    if args.cascade:
+        run_cascade(args.input_files, args.sample_index)
+    else:
+        run_judges([load_backend(name) for name in args.judges], args.input_files, args.sample_index)
+
+
+if __name__ == "__main__":
+    main()
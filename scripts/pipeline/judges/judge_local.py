@@ -0,0 +1,54 @@
+"""
+Judge QA pairs with any OpenAI-compatible chat completions endpoint (vLLM, llama.cpp, SGLang, or
+stub_server.py) over concurrent real-time calls.
+
+Meant for iterating on parsing, merging and ensembling without paying for provider batches: results are
+written to the usual output/local_judge/{model}/ batch files and merged as the 'local' judge.
+
+Usage:
+    python judge_local.py <exploded_csv_file> [sample_index]
+
+    LOCAL_JUDGE_BASE_URL  endpoint base URL (default: http://localhost:8000/v1)
+    LOCAL_JUDGE_MODEL     model name as served by the endpoint (default: stub)
+    LOCAL_JUDGE_API_KEY   API key, if the server requires one
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared_utils import http_session
+from judge_engine import main_for_backend
+from judge_gpt4o import OpenAIBackend
+
+BASE_URL = os.getenv("LOCAL_JUDGE_BASE_URL", "http://localhost:8000/v1")
+JUDGE_MODEL = os.getenv("LOCAL_JUDGE_MODEL", "stub")
+MAX_IN_FLIGHT = 128  # matches the shared session's keep-alive pool per host
+REQUESTS_PER_MINUTE = 600_000
+REQUEST_TIMEOUT = 600
+
+
+class LocalBackend(OpenAIBackend):
+    """OpenAI request and response format, sent to BASE_URL one pair at a time instead of as batch jobs."""
+
+    name = 'local'
+    title = 'Local'
+    judge_model = JUDGE_MODEL
+    api_key_env = 'LOCAL_JUDGE_API_KEY'
+    log_name = 'judge_local.log'
+    realtime_only = True
+    realtime_max_in_flight = MAX_IN_FLIGHT
+    realtime_requests_per_minute = REQUESTS_PER_MINUTE
+    default_api_key = 'EMPTY'
+
+    def judge_realtime(self, qa):
+        """Judge one pair with a chat completions call to the local endpoint."""
+        response = http_session().post(f"{BASE_URL}/chat/completions",
+                                       headers={"Authorization": f"Bearer {self.api_key}"},
+                                       json=self.build_request(qa)['body'], timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return self.parse_result({'response': {'status_code': response.status_code, 'body': response.json()}})
+
+
+if __name__ == "__main__":
+    main_for_backend(LocalBackend, "judge_local.py")
@@ -2,7 +2,7 @@
 Simple, robust judge merge script.
 Just updates rating and reason columns - nothing fancy.
 
-Usage: python merge_judge_fixed.py <csv_file> <judge_name>
+Usage: python merge_judge_fixed.py <csv_file> <judge_name> [sample_index]
 Example: python merge_judge_fixed.py ../../output/gemini_2.5_pro.csv claude
 """
 
@@ -12,7 +12,7 @@ import csv
 from glob import glob
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from shared_utils import setup_logger, log_and_print
+from shared_utils import setup_logger, log_and_print, sample_suffix
 
 csv.field_size_limit(500000)
 
@@ -43,16 +43,17 @@ def load_judge_results_from_batches(judge_dir):
 
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python merge_judge_fixed.py <csv_file> <judge_name>")
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python merge_judge_fixed.py <csv_file> <judge_name> [sample_index]")
         print("Example: python merge_judge_fixed.py ../../output/gemini_2.5_pro.csv claude")
         sys.exit(1)
 
     csv_file = sys.argv[1]
     judge_name = sys.argv[2].lower()
+    sample_index = int(sys.argv[3]) if len(sys.argv) == 4 else 1
 
-    if judge_name not in ['claude', 'gemini', 'openai']:
-        print(f"ERROR: Invalid judge name '{judge_name}'. Must be: claude, gemini, or openai")
+    if judge_name not in ['claude', 'gemini', 'openai', 'local']:
+        print(f"ERROR: Invalid judge name '{judge_name}'. Must be: claude, gemini, openai, or local")
         sys.exit(1)
 
     if not os.path.exists(csv_file):
@@ -69,10 +70,11 @@ def main():
     log_and_print(logger, f"Input: {csv_file}")
     log_and_print(logger, "=" * 80)
 
-    rating_col = f"{judge_name.title()}_Judge_Rating"
-    reason_col = f"{judge_name.title()}_Judge_Reason"
+    rating_col = f"{judge_name.title()}_Judge_Rating{sample_suffix(sample_index)}"
+    reason_col = f"{judge_name.title()}_Judge_Reason{sample_suffix(sample_index)}"
 
-    judge_dir = f"../../output/{judge_name}_judge/{model_name}"
+    judge_model_name = model_name if sample_index == 1 else f"{model_name}_sample_{sample_index}"
+    judge_dir = f"../../output/{judge_name}_judge/{judge_model_name}"
     if not os.path.exists(judge_dir):
         log_and_print(logger, f"ERROR: Judge directory not found: {judge_dir}")
         sys.exit(1)
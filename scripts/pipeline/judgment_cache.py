@@ -0,0 +1,97 @@
+"""
+Persistent judgment cache shared by all judges and model CSVs.
+
+Many answers ("Yes", "No", short numbers) repeat across models and re-runs. Judgments are stored
+under a hash of the normalized question, reference answer and model answer plus the judge model and
+a hash of the judge prompt, so a change to either invalidates old entries automatically.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import unicodedata
+from datetime import datetime
+
+CACHE_FILE = "../../../output/judgment_cache.sqlite"
+
+
+def normalize_text(text):
+    """Unicode-normalize and collapse whitespace; case is kept since it can matter in math answers."""
+    return ' '.join(unicodedata.normalize('NFC', str(text)).split())
+
+
+def template_hash(prompt_template):
+    return hashlib.sha256(prompt_template.encode('utf-8')).hexdigest()
+
+
+class JudgmentCache:
+    """SQLite-backed map from judged (question, reference, answer) triples to rating and reason.
+
+    Lookups use prompt_template; store takes the template of the requests actually sent when it differs.
+    """
+
+    def __init__(self, path, judge_model, prompt_template):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.judge_model = judge_model
+        self.prompt_hash = template_hash(prompt_template)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS judgments (
+                key TEXT PRIMARY KEY,
+                judge_model TEXT NOT NULL,
+                rating INTEGER NOT NULL,
+                reason TEXT,
+                created_at TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def key(self, qa, prompt_hash=None):
+        payload = [
+            normalize_text(qa['question']),
+            normalize_text(qa['reference_answer']),
+            normalize_text(qa['model_answer']),
+            self.judge_model,
+            prompt_hash or self.prompt_hash,
+        ]
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def lookup(self, qa_pairs):
+        """Return {qa_id: result} for every pair with a cached judgment."""
+        keys = {}
+        for qa in qa_pairs:
+            keys.setdefault(self.key(qa), []).append(qa['id'])
+
+        cached = {}
+        key_list = list(keys)
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, rating, reason FROM judgments WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for key, rating, reason in rows:
+                for qa_id in keys[key]:
+                    cached[qa_id] = {'rating': rating, 'reason': reason, 'source': 'cache'}
+        return cached
+
+    def store(self, qa_pairs, results, prompt_template=None):
+        """Cache every valid (1-4) judgment in results; failed or missing ones are left out."""
+        store_hash = template_hash(prompt_template) if prompt_template else self.prompt_hash
+        now = datetime.now().isoformat()
+        rows = []
+        for qa in qa_pairs:
+            result = results.get(qa['id'])
+            if not result or result.get('source') == 'cache':
+                continue
+            try:
+                rating = int(result['rating'])
+            except (ValueError, TypeError):
+                continue
+            if 1 <= rating <= 4:
+                rows.append((self.key(qa, store_hash), self.judge_model, rating, result.get('reason', ''), now))
+
+        self.conn.executemany("INSERT OR REPLACE INTO judgments VALUES (?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+        return len(rows)
@@ -0,0 +1,111 @@
+"""
+Local deterministic pre-judge for answers that match the reference exactly or numerically.
+
+Many reference answers are short numbers, fractions or expressions ("3/4", "12 cm", "3x + 2 = 8").
+When the model answer is the same after normalization (whitespace, trailing punctuation and units)
+or denotes the same number (fraction/decimal/mixed-number equivalence), it is rated 4 locally and never
+sent to an LLM judge. Anything less certain is left to the judges. Case is kept, as in the judgment
+cache, since "X" and "x" can be different answers in math.
+"""
+
+import re
+import unicodedata
+from fractions import Fraction
+
+LOCAL_REASON = "Locally judged: answer matches the ground truth after normalization"
+
+NUMBER_PATTERN = re.compile(
+    r'^(?P<number>[-+]?(?:\d+\s+\d+/\d+|\d+/\d+|\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d*\.?\d+))'
+    r'\s*(?P<unit>[a-z°%²³]+(?:\s+[a-z²³]+)?)?$'
+)
+
+# Only these trailing units are ignored; "3 apples" vs "3" is left to the judges.
+UNITS = {
+    '%', '°', 'degree', 'degrees', 'unit', 'units', 'square units', 'sq units', 'cubic units', 'units²', 'units³',
+    'mm', 'cm', 'm', 'km', 'in', 'inch', 'inches', 'ft', 'foot', 'feet', 'yd', 'yard', 'yards', 'mi', 'mile', 'miles',
+    'cm²', 'm²', 'in²', 'ft²', 'square cm', 'square inches', 'square feet', 'square meters',
+    'g', 'kg', 'lb', 'lbs', 'oz', 'ml', 'l', 'cup', 'cups',
+    's', 'sec', 'seconds', 'min', 'minutes', 'h', 'hr', 'hrs', 'hour', 'hours', 'day', 'days',
+    'cent', 'cents', 'dollar', 'dollars',
+}
+
+# Whitespace next to these is insignificant ("x = 3" is "x=3"); whitespace between two digits is not.
+OPERATOR_SPACING = re.compile(r'\s*([=+\-*/^(),<>:])\s*')
+
+SYMBOL_REPLACEMENTS = {
+    '−': '-',   # minus sign
+    '–': '-',   # en dash
+    '×': '*',   # multiplication sign
+    '⋅': '*',   # dot operator
+    '÷': '/',   # division sign
+    '⁄': '/',   # fraction slash
+}
+
+
+def normalize_answer(text):
+    """Unify math symbols, drop LaTeX $ delimiters and trailing punctuation, collapse whitespace; keep case."""
+    text = unicodedata.normalize('NFC', str(text))
+    for symbol, replacement in SYMBOL_REPLACEMENTS.items():
+        text = text.replace(symbol, replacement)
+    text = text.replace('$', '')
+    text = ' '.join(text.split())
+    return text.rstrip('.!').strip()
+
+
+def compact_operators(text):
+    """Remove whitespace around operators and punctuation, keeping it between words and digits."""
+    return OPERATOR_SPACING.sub(r'\1', text)
+
+
+def parse_number(text):
+    """Parse '3/4', '1 1/2', '0.75', '1,000', '12 cm' into (Fraction, unit) or None."""
+    match = NUMBER_PATTERN.match(text)
+    if not match:
+        return None
+
+    unit = match.group('unit')
+    if unit and unit not in UNITS:
+        return None
+
+    number = match.group('number').replace(',', '')
+    sign = -1 if number.startswith('-') else 1
+    number = number.lstrip('+-')
+    try:
+        if ' ' in number:
+            whole, fraction = number.split()
+            value = int(whole) + Fraction(fraction)
+        else:
+            value = Fraction(number)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return sign * value, unit
+
+
+def answers_equivalent(reference, answer):
+    """True if answer is textually or numerically identical to reference after normalization."""
+    reference = normalize_answer(reference)
+    answer = normalize_answer(answer)
+    if not reference or not answer:
+        return False
+
+    if reference == answer or compact_operators(reference) == compact_operators(answer):
+        return True
+
+    reference_number = parse_number(reference)
+    answer_number = parse_number(answer)
+    if reference_number is None or answer_number is None:
+        return False
+
+    (reference_value, reference_unit), (answer_value, answer_unit) = reference_number, answer_number
+    if reference_unit and answer_unit and reference_unit != answer_unit:
+        return False
+    return reference_value == answer_value
+
+
+def local_judgments(qa_pairs):
+    """Return {qa_id: result} with a rating of 4 for every pair the local checker is confident about."""
+    return {
+        qa['id']: {'rating': 4, 'reason': LOCAL_REASON, 'source': 'local'}
+        for qa in qa_pairs
+        if answers_equivalent(qa['reference_answer'], qa['model_answer'])
+    }
@@ -8,13 +8,10 @@ For example, given the question:
 Generate your answer as: "3x + 2 = 8"
 """
 
-JUDGE_PROMPT_TEMPLATE = """
-Given the following inputs:
-Question: {question}
-Answer 1 (Ground Truth): {teacher_a}
-Answer 2 (Model Output): {model_a}
-
-Your task is to rate the quality of Answer 2, using Answer 1 as the ground truth for a perfect response. Use the following 4-point scale:
+# The judge prompt is split so the fixed rubric forms an identical prefix (system prompt) for every
+# request and only the short per-pair inputs vary; providers can then serve the prefix from their
+# prompt caches.
+JUDGE_RUBRIC = """Your task is to rate the quality of Answer 2, using Answer 1 as the ground truth for a perfect response. Use the following 4-point scale:
 
 
 **4: Semantically Identical**
@@ -30,7 +27,84 @@ Your task is to rate the quality of Answer 2, using Answer 1 as the ground truth
 - Or, it mixes correct information with fabricated/hallucinated details not supported by the question or Answer 1.
 
 **1: Irrelevant or Wrong**
-- Answer 2 completely fails to answer the question, is on a different topic, or is nonsensical.
+- Answer 2 completely fails to answer the question, is on a different topic, or is nonsensical."""
+
+JUDGE_SYSTEM_PROMPT = """You will be given a question, Answer 1 (Ground Truth) and Answer 2 (Model Output).
+
+""" + JUDGE_RUBRIC + """
+
+
+Provide both the Likert rating followed by a brief explanation for your choice. Format the output as a valid parsable JSON like: {"rating": 1-4, "reason": "Your brief justification here."}"""
+
+JUDGE_INPUT_TEMPLATE = """Given the following inputs:
+Question: {question}
+Answer 1 (Ground Truth): {teacher_a}
+Answer 2 (Model Output): {model_a}"""
+
+# The complete judge prompt; its hash keys the judgment cache and the token analysis.
+JUDGE_PROMPT_TEMPLATE = JUDGE_SYSTEM_PROMPT + "\n\n" + JUDGE_INPUT_TEMPLATE
+
+# Multi-item judging (--items-per-request): several independent pairs in one request, rated separately
+# under the same rubric and returned as one JSON object with a judgment per numbered item.
+JUDGE_MULTI_OUTPUT_FORMAT = """For every item, provide the Likert rating of its Answer 2 followed by a brief explanation for your choice. Format the output as a valid parsable JSON like: {"judgments": [{"item": 1, "rating": 1-4, "reason": "Your brief justification here."}, ...]} with exactly one judgment per item."""
+
+JUDGE_MULTI_SYSTEM_PROMPT = """You will be given several numbered items, each with a question, Answer 1 (Ground Truth) and Answer 2 (Model Output). Judge every item on its own; the items are unrelated.
+
+""" + JUDGE_RUBRIC + "\n\n\n" + JUDGE_MULTI_OUTPUT_FORMAT
+
+JUDGE_ITEM_TEMPLATE = """Item {number}:
+Question: {question}
+Answer 1 (Ground Truth): {teacher_a}
+Answer 2 (Model Output): {model_a}"""
+
+JUDGE_MULTI_PROMPT_TEMPLATE = JUDGE_MULTI_SYSTEM_PROMPT + "\n\nGiven the following items:\n\n" + JUDGE_ITEM_TEMPLATE
+
+# Listwise judging (--listwise): one question and reference with the answers of several models, in random
+# order, each rated on its own. The reply has the multi-item format, so the rubric, question and
+# reference are sent once for all models.
+JUDGE_LISTWISE_SYSTEM_PROMPT = """You will be given a question, Answer 1 (Ground Truth) and several numbered items, each holding an Answer 2 (Model Output) written by a different model. Judge every item's Answer 2 on its own against Answer 1; do not rank the items against each other or let their order affect the ratings.
+
+""" + JUDGE_RUBRIC + "\n\n\n" + JUDGE_MULTI_OUTPUT_FORMAT
+
+JUDGE_LISTWISE_INPUT_TEMPLATE = """Given the following question and answers:
+Question: {question}
+Answer 1 (Ground Truth): {teacher_a}"""
+
+JUDGE_LISTWISE_ITEM_TEMPLATE = """Item {number}:
+Answer 2 (Model Output): {model_a}"""
+
+JUDGE_LISTWISE_PROMPT_TEMPLATE = (JUDGE_LISTWISE_SYSTEM_PROMPT + "\n\n" + JUDGE_LISTWISE_INPUT_TEMPLATE + "\n\n"
+                                  + JUDGE_LISTWISE_ITEM_TEMPLATE)
 
+# Schema for structured judge output (OpenAI json_schema, Anthropic tool input, Gemini responseSchema).
+JUDGE_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "rating": {"type": "integer", "enum": [1, 2, 3, 4]},
+        "reason": {"type": "string"}
+    },
+    "required": ["rating", "reason"],
+    "additionalProperties": False
+}
 
-Provide both the Likert rating followed by a brief explanation for your choice. Format the output as a valid parsable JSON like: {{"rating": 1-4, "reason": "Your brief justification here."}}"""
+# Schema for multi-item and listwise judge output: one judgment per numbered item.
+JUDGE_MULTI_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "judgments": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "item": {"type": "integer"},
+                    "rating": {"type": "integer", "enum": [1, 2, 3, 4]},
+                    "reason": {"type": "string"}
+                },
+                "required": ["item", "rating", "reason"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["judgments"],
+    "additionalProperties": False
+}
@@ -0,0 +1,40 @@
+"""
+Provider and metric registry.
+
+Backends are listed by import path and imported only when selected, so help output, merges,
+score printing and ensemble-only evaluation don't pay multi-second SDK import costs.
+"""
+
+import importlib
+
+PROVIDERS = {
+    "anthropic": ("anthropic", "Anthropic"),
+    "openai": ("openai", "OpenAI"),
+    "google": ("google.generativeai", None),
+    "together": ("together", "Together"),
+}
+
+METRICS = {
+    "BERTScore F1": "bertscore",
+    "ROUGEL": "rouge",
+}
+
+
+def load_provider(name):
+    """Import and return the SDK module for a provider."""
+    module_path, _ = PROVIDERS[name]
+    return importlib.import_module(module_path)
+
+
+def create_client(name, **kwargs):
+    """Instantiate the SDK client class for a provider, e.g. create_client("openai", api_key=...)."""
+    _, client_class = PROVIDERS[name]
+    if client_class is None:
+        raise ValueError(f"Provider '{name}' has no client class; use load_provider() instead")
+    return getattr(load_provider(name), client_class)(**kwargs)
+
+
+def load_metric(column):
+    """Load the `evaluate` metric that fills a metric column, e.g. load_metric("ROUGEL")."""
+    from evaluate import load
+    return load(METRICS[column])
@@ -0,0 +1,228 @@
+"""
+Pipelined generation-to-judging.
+
+Runs a generator and streams every freshly answered row into micro-batches that are handed to the
+judge scripts while generation continues, so end-to-end time approaches the longer of the two stages
+instead of their sum. Each micro-batch gets its own judge process, which submits its provider batch
+and waits for it; up to `--max-pending` of them run at once per judge. Further micro-batches wait on
+disk until one finishes, so generation never waits for judge results.
+
+Usage:
+    python run_pipeline.py --generator openai
+    python run_pipeline.py --generator openai_compatible --base-url http://localhost:8000/v1 --model my-model
+    python run_pipeline.py --generator anthropic --judges claude openai --micro-batch 500
+"""
+
+import os
+import sys
+import time
+import queue
+import signal
+import argparse
+import importlib
+import threading
+import subprocess
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from shared_utils import (setup_logger, log_and_print, read_csv_as_dicts, write_csv_from_dicts,
+                          install_shutdown_handlers, shutdown_requested)
+
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATION_DIR = os.path.join(PIPELINE_DIR, "generation")
+JUDGES_DIR = os.path.join(PIPELINE_DIR, "judges")
+
+GENERATORS = ["anthropic", "google", "openai", "together", "openai_compatible"]
+JUDGE_SCRIPTS = {
+    "claude": "judge_claude.py",
+    "gemini": "judge_gemini.py",
+    "openai": "judge_gpt4o.py",
+}
+
+RUN_ID = datetime.now().strftime("%Y%m%d_%H%M%S")
+MICRO_BATCH_SIZE = 1000
+MAX_PENDING = 20  # judge processes (outstanding provider batches) per judge; OpenAI's MAX_ACTIVE_BATCHES
+
+
+class MicroBatcher:
+    """Collect answered rows and hand each full micro-batch to every judge queue (unbounded, never blocks)."""
+
+    def __init__(self, csv_name, judge_queues, size, logger):
+        self.csv_name = csv_name
+        self.judge_queues = judge_queues
+        self.size = size
+        self.logger = logger
+        self.rows = []
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, row):
+        with self.lock:
+            self.rows.append(dict(row))
+            if len(self.rows) >= self.size:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            if self.rows:
+                self._flush()
+
+    def _flush(self):
+        self.count += 1
+        stream_dir = f"../../../output/streaming/{self.csv_name}/{RUN_ID}/{self.count:04d}"
+        os.makedirs(stream_dir, exist_ok=True)
+
+        # Judges derive their output directory from the file name, so keep it equal to the model CSV name.
+        path = os.path.abspath(os.path.join(stream_dir, f"{self.csv_name}.csv"))
+        write_csv_from_dicts(path, self.rows, list(self.rows[0].keys()))
+        log_and_print(self.logger, f"Micro-batch {self.count}: {len(self.rows)} rows -> {path}")
+        self.rows = []
+
+        for judge_queue in self.judge_queues.values():
+            judge_queue.put(path)
+
+
+def start_judge_script(script, csv_path):
+    """Start one judge script on a micro-batch CSV in its own session, so Ctrl-C reaches only this process."""
+    return subprocess.Popen(
+        [sys.executable, script, csv_path],
+        cwd=JUDGES_DIR,
+        stdout=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def judge_worker(judge, judge_queue, max_running, logger):
+    """Start a judge process per micro-batch, at most max_running at once, until the sentinel (None) arrives
+    and every process has exited. A shutdown request is forwarded to the running processes as SIGTERM."""
+    script = JUDGE_SCRIPTS[judge]
+    running = {}
+    forwarded = set()
+    queue_done = False
+
+    while running or not queue_done:
+        for process, (csv_path, started) in list(running.items()):
+            if process.poll() is not None:
+                del running[process]
+                log_and_print(logger, f"[{judge}] Finished {csv_path} (exit {process.returncode}, "
+                                      f"{time.time() - started:.0f}s, {len(running)} running)")
+
+        if shutdown_requested():
+            for process in running:
+                if process not in forwarded:
+                    process.send_signal(signal.SIGTERM)
+                    forwarded.add(process)
+
+        if queue_done or len(running) >= max_running:
+            time.sleep(1)
+            continue
+
+        try:
+            csv_path = judge_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        if csv_path is None:
+            queue_done = True
+            continue
+        if shutdown_requested():
+            continue
+
+        running[start_judge_script(script, csv_path)] = (csv_path, time.time())
+        log_and_print(logger, f"[{judge}] Judging {csv_path} ({len(running)} running, "
+                              f"{judge_queue.qsize()} waiting)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run generation and judging as a streaming pipeline')
+    parser.add_argument('--generator', required=True, choices=GENERATORS,
+                        help='Generation backend (uses SELECTED_MODEL from that script)')
+    parser.add_argument('--judges', nargs='+', default=list(JUDGE_SCRIPTS), choices=list(JUDGE_SCRIPTS),
+                        help='Judges to run on each micro-batch (default: all)')
+    parser.add_argument('--micro-batch', type=int, default=MICRO_BATCH_SIZE,
+                        help=f'Answered rows per judge submission (default: {MICRO_BATCH_SIZE})')
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING,
+                        help=f'Judge processes (provider batches) running at once per judge; later micro-batches '
+                             f'wait on disk without blocking generation (default: {MAX_PENDING})')
+    parser.add_argument('--base-url', help='openai_compatible only: server base URL')
+    parser.add_argument('--model', help='openai_compatible only: served model name')
+    parser.add_argument('--csv-name', help='openai_compatible only: output CSV name')
+    parser.add_argument('--max-in-flight', type=int, help='openai_compatible only: concurrent requests')
+    parser.add_argument('--num-samples', type=int, default=1, help='openai_compatible only: samples per question')
+    args = parser.parse_args()
+
+    if args.generator == "openai_compatible" and not (args.base_url and args.model):
+        parser.error("--generator openai_compatible requires --base-url and --model")
+
+    install_shutdown_handlers()
+
+    # Stage scripts resolve ../../../output relative to their own directory.
+    os.chdir(GENERATION_DIR)
+    sys.path.insert(0, GENERATION_DIR)
+    generator = importlib.import_module(f"generate_{args.generator}")
+
+    if args.generator == "openai_compatible":
+        csv_name = args.csv_name or generator.default_csv_name(args.model)
+        input_csv = f"{generator.OUTPUT_ROOT}/{csv_name}.csv"
+        gen_logger = generator.setup_logger(f"{generator.LOG_ROOT}/{csv_name}/generation.log")
+    else:
+        csv_name = generator.CSV_NAME
+        input_csv = generator.INPUT_CSV
+        gen_logger = generator.setup_logger()
+
+    log_dir = f"../../../logs/{csv_name}"
+    os.makedirs(log_dir, exist_ok=True)
+    logger = setup_logger(f"{log_dir}/pipeline.log")
+    # Generators configure the root logger; keep pipeline messages out of generation.log and off the console twice.
+    logger.propagate = False
+
+    log_and_print(logger, "="*80)
+    log_and_print(logger, "Streaming Generation -> Judging Pipeline")
+    log_and_print(logger, f"Generator: {args.generator}")
+    log_and_print(logger, f"Input: {input_csv}")
+    log_and_print(logger, f"Judges: {', '.join(args.judges)}")
+    log_and_print(logger, f"Micro-batch size: {args.micro_batch}, judge processes per judge: {args.max_pending}")
+    log_and_print(logger, "="*80)
+
+    data = read_csv_as_dicts(input_csv)
+    previously_answered = [row for row in data if row.get("Model Answer", "").strip()]
+    log_and_print(logger, f"Loaded {len(data)} rows ({len(previously_answered)} already answered)")
+
+    judge_queues = {judge: queue.Queue() for judge in args.judges}
+    workers = [
+        threading.Thread(target=judge_worker, args=(judge, judge_queue, args.max_pending, logger), daemon=True)
+        for judge, judge_queue in judge_queues.items()
+    ]
+    for worker in workers:
+        worker.start()
+
+    batcher = MicroBatcher(csv_name, judge_queues, args.micro_batch, logger)
+
+    if args.generator == "openai_compatible":
+        max_in_flight = args.max_in_flight or generator.MAX_IN_FLIGHT
+        client = generator.create_pooled_client(args.base_url, os.getenv("OPENAI_COMPATIBLE_API_KEY", "EMPTY"),
+                                                max_in_flight)
+        generator.run_generation(data, client, args.model, input_csv, max_in_flight, args.num_samples,
+                                 gen_logger, on_answer=batcher.add)
+    else:
+        generator.run_generation(data, True, True, True, gen_logger, on_answer=batcher.add)
+
+    if not shutdown_requested():
+        # Rows answered by earlier runs go last; judges skip any that are already judged.
+        for row in previously_answered:
+            batcher.add(row)
+        batcher.flush()
+
+    log_and_print(logger, f"Generation finished after {batcher.count} micro-batch(es); waiting for judges...")
+    for judge_queue in judge_queues.values():
+        judge_queue.put(None)
+    for worker in workers:
+        worker.join()
+
+    log_and_print(logger, "="*80)
+    log_and_print(logger, "Pipeline stopped early" if shutdown_requested() else "Pipeline complete")
+    log_and_print(logger, f"Next: merge each judge with merge_judge.py, then run run_evaluation.py on {csv_name}.csv")
+    log_and_print(logger, "="*80)
+
+
+if __name__ == "__main__":
+    main()
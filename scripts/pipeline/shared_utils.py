@@ -1,8 +1,25 @@
+import os
 import csv
+import time
 import json
 import ast
+import fcntl
+import queue
+import hashlib
+import sqlite3
+import signal
 import logging
+import threading
+from glob import glob
 from datetime import datetime
+from concurrent.futures import Future
+
+SHUTDOWN_EVENT = threading.Event()
+_HTTP_SESSION = None
+HTTP_POOL_HOSTS = 8      # hosts with a kept-alive connection pool (API, upload and download hosts)
+HTTP_POOL_SIZE = 128     # connections kept alive per host
+HTTP_MAX_RETRIES = 3
+CASCADE_MARKER = "cascade.json"  # in output/{judge}_judge/{model}/ while that judge only rated a cascade's disagreements
 
 
 def setup_logger(log_file):
@@ -56,3 +73,277 @@ def get_questions(qa_json):
 
     questions = [item['question'] for item in qa_list if 'question' in item]
     return questions
+
+
+def sample_suffix(sample_index):
+    """Column suffix for a self-consistency sample; sample 1 uses the plain column names."""
+    return '' if sample_index == 1 else f' Sample {sample_index}'
+
+
+def answer_columns(num_samples):
+    """Answer columns for n samples: 'Model Answer', then 'Model Answer Sample 2'..'Model Answer Sample n'."""
+    return [f"Model Answer{sample_suffix(i)}" for i in range(1, num_samples + 1)]
+
+
+def http_session():
+    """Process-wide requests.Session, so every REST call reuses the same keep-alive connections.
+
+    The pool keeps up to HTTP_POOL_SIZE connections per host open for concurrent real-time judging.
+    Connection failures and 429/5xx responses to idempotent requests (polls, listings, downloads) are
+    retried with exponential backoff, honouring Retry-After. POSTs are only retried when the connection
+    could not be established, so a batch job is never created twice.
+    """
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=HTTP_MAX_RETRIES, connect=HTTP_MAX_RETRIES, read=HTTP_MAX_RETRIES,
+                      status=HTTP_MAX_RETRIES, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                      respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _HTTP_SESSION = session
+    return _HTTP_SESSION
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls evenly at up to requests_per_minute."""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the caller may send its next request."""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(start - now)
+
+
+class DaemonThreadPool:
+    """Minimal executor on daemon threads: calls still blocked on the network when the caller gives up do not
+    keep the interpreter from exiting, unlike ThreadPoolExecutor workers, which are joined at exit."""
+
+    def __init__(self, max_workers):
+        self.tasks = queue.SimpleQueue()
+        self.num_workers = max_workers
+        for _ in range(max_workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            future, fn, args = task
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.tasks.put((future, fn, args))
+        return future
+
+    def shutdown(self):
+        """Cancel queued calls and let idle workers exit; running calls are abandoned, not waited for."""
+        while True:
+            try:
+                task = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is not None:
+                task[0].cancel()
+        for _ in range(self.num_workers):
+            self.tasks.put(None)
+
+
+def install_shutdown_handlers():
+    """Turn SIGINT/SIGTERM into a shutdown request; a second signal aborts immediately."""
+    def handle_signal(signum, frame):
+        if SHUTDOWN_EVENT.is_set():
+            raise KeyboardInterrupt
+        SHUTDOWN_EVENT.set()
+        print(f"\nReceived {signal.Signals(signum).name}: finishing in-flight work and flushing results "
+              f"(send again to abort)", flush=True)
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+
+def shutdown_requested():
+    """True once SIGINT/SIGTERM has been received."""
+    return SHUTDOWN_EVENT.is_set()
+
+
+def wait_or_shutdown(seconds):
+    """Sleep up to `seconds`, waking early on shutdown. Returns True if shutdown was requested."""
+    return SHUTDOWN_EVENT.wait(seconds)
+
+
+class BatchLedger:
+    """On-disk record of every provider batch job a judge creates, so later runs can reattach to it.
+
+    Entries hold the provider, job ID, batch number, QA IDs, a hash of the judged inputs and a status:
+    'submitted' until the results are written, then 'collected' (or 'rejected', 'stale', 'superseded').
+    Jobs of multi-item requests also hold 'units', the custom IDs of the pairs in each request.
+
+    Several judge processes may share a ledger (run_pipeline.py judges micro-batches concurrently), so
+    each save merges this process's new and updated entries into the file under a lock.
+    """
+
+    def __init__(self, path, provider, judge_model):
+        self.path = path
+        self.provider = provider
+        self.judge_model = judge_model
+        self.entries = []
+        self.changed = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def input_hash(self, qa_pairs):
+        """Hash of the judge model and every (ID, question, reference, answer) in a batch."""
+        payload = [self.judge_model] + [
+            [qa['id'], qa['question'], qa['reference_answer'], qa['model_answer']] for qa in qa_pairs
+        ]
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def record(self, job_id, batch_num, qa_pairs, output_dir, units=None):
+        """Add a newly created job; called before the job is first polled."""
+        now = datetime.now().isoformat()
+        entry = {
+            'provider': self.provider,
+            'job_id': job_id,
+            'batch_num': batch_num,
+            'output_dir': output_dir,
+            'qa_ids': [qa['id'] for qa in qa_pairs],
+            'input_hash': self.input_hash(qa_pairs),
+            'status': 'submitted',
+            'created_at': now,
+            'updated_at': now
+        }
+        if units:
+            entry['units'] = units
+        self.entries.append(entry)
+        self.changed.add(job_id)
+        self._save()
+
+    def update(self, job_id, status):
+        for entry in self.entries:
+            if entry['job_id'] == job_id:
+                entry['status'] = status
+                entry['updated_at'] = datetime.now().isoformat()
+                self.changed.add(job_id)
+        self._save()
+
+    def unfinished(self):
+        return [e for e in self.entries if e['provider'] == self.provider and e['status'] == 'submitted']
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            on_disk = []
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    on_disk = json.load(f)
+            mine = {entry['job_id']: entry for entry in self.entries if entry['job_id'] in self.changed}
+            self.entries = [mine.pop(entry['job_id'], entry) for entry in on_disk] + list(mine.values())
+
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(temp_path, self.path)
+
+
+def reattach_batches(ledger, qa_pairs, judged_ids, logger):
+    """Match unfinished ledger jobs against the pairs still to judge.
+
+    Returns (reattached, remaining): a (qa_pairs, job) tuple per job whose inputs are unchanged,
+    and the pairs not covered by any of them. Jobs for other input files are left untouched.
+    """
+    pending = {qa['id']: qa for qa in qa_pairs}
+    reattached = []
+
+    for entry in ledger.unfinished():
+        qa_ids = entry['qa_ids']
+        if all(qa_id in judged_ids for qa_id in qa_ids):
+            ledger.update(entry['job_id'], 'superseded')
+            continue
+        if not any(qa_id in pending for qa_id in qa_ids):
+            continue
+
+        batch_pairs = [pending[qa_id] for qa_id in qa_ids if qa_id in pending]
+        if len(batch_pairs) != len(qa_ids) or ledger.input_hash(batch_pairs) != entry['input_hash']:
+            log_and_print(logger, f"  Ledger job {entry['job_id']} no longer matches the input; resubmitting its pairs")
+            ledger.update(entry['job_id'], 'stale')
+            continue
+
+        log_and_print(logger, f"  Reattaching to {entry['job_id']} ({len(batch_pairs)} pairs)")
+        reattached.append((batch_pairs, {
+            'id': entry['job_id'],
+            'state': 'submitted',
+            'submitted_at': datetime.fromisoformat(entry['created_at']).timestamp(),
+            'units': entry.get('units')
+        }))
+        for qa in batch_pairs:
+            del pending[qa['id']]
+
+    remaining = [qa for qa in qa_pairs if qa['id'] in pending]
+    return reattached, remaining
+
+
+def is_valid_rating(rating):
+    """True for a judge rating between 1 and 4; failed judgments are stored as -1."""
+    try:
+        return 1 <= float(str(rating).strip()) <= 4
+    except (ValueError, TypeError):
+        return False
+
+
+def record_judged_ids(index_file, rows):
+    """Add the QA IDs of rows (batch CSV rows) with a valid Judge_Rating to the judged-ID index."""
+    qa_ids = [(row['QA_Pair_ID'],) for row in rows if row['QA_Pair_ID'] and is_valid_rating(row['Judge_Rating'])]
+    with sqlite3.connect(index_file, timeout=30) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS judged (qa_id TEXT PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO judged VALUES (?)", qa_ids)
+    conn.close()
+
+
+def load_judged_ids(index_file, logger):
+    """Load judged QA IDs for one (judge, model) from its index.
+
+    The index sits next to the timestamp directories and is updated whenever a batch file is written,
+    so startup no longer rescans every batch file. It is built from existing batch files on first use.
+    """
+    if not os.path.exists(index_file):
+        batch_files = sorted(glob(os.path.join(os.path.dirname(index_file), "*", "batch_*.csv")))
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        log_and_print(logger, f"Building judged-ID index from {len(batch_files)} existing batch files")
+        rows = []
+        for batch_file in batch_files:
+            try:
+                rows.extend(read_csv_as_dicts(batch_file))
+            except Exception as e:
+                log_and_print(logger, f"Warning: Failed to read {batch_file}: {e}")
+        record_judged_ids(index_file, [
+            {'QA_Pair_ID': row.get('QA_Pair_ID', '').strip(), 'Judge_Rating': row.get('Judge_Rating', '')}
+            for row in rows
+        ])
+
+    with sqlite3.connect(index_file, timeout=30) as conn:
+        judged_ids = {qa_id for (qa_id,) in conn.execute("SELECT qa_id FROM judged")}
+    conn.close()
+
+    log_and_print(logger, f"Loaded {len(judged_ids)} already-judged QA pairs from {index_file}")
+    return judged_ids
@@ -0,0 +1,146 @@
+"""
+Minimal OpenAI-compatible chat completions server for local load testing.
+
+Answers every POST to /v1/chat/completions with a canned reply after an optional delay,
+so the OpenAI-compatible backends can be exercised at high request rates without a GPU. With --judge
+it replies with a judgment JSON instead, whose rating is a stable hash of the judged pair, for the local
+judge; multi-item and listwise requests get one judgment per "Item N:" block, rated like the same pair
+judged alone.
+
+Usage:
+    python stub_server.py --port 8000 --latency 0.5
+    python generation/generate_openai_compatible.py --base-url http://localhost:8000/v1 --model stub
+
+    python stub_server.py --port 8000 --judge
+    python judges/judge_local.py ../../output/your_model.csv
+"""
+
+import re
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_REPLY = "3x + 2 = 8"
+
+
+def stub_rating(pair_text):
+    """A stable 1-4 rating for one judged pair, so reruns and single- and multi-item requests agree."""
+    return 1 + int(hashlib.sha256(pair_text.strip().encode('utf-8')).hexdigest(), 16) % 4
+
+
+def judgment_reply(body):
+    """A judgment in the judge's JSON format, or one per numbered item for multi-item and listwise requests.
+
+    Listwise items only hold the answer; the question and reference ahead of them are rated with each.
+    """
+    prompt = next((m.get('content', '') for m in body.get('messages', []) if m.get('role') == 'user'), '')
+    head, *items = re.split(r'^Item \d+:$', prompt, flags=re.MULTILINE)
+    if items:
+        shared = head[head.find('Question:'):].strip() + '\n' if 'Question:' in head else ''
+        ratings = [stub_rating(shared + item.strip()) for item in items]
+        return json.dumps({'judgments': [
+            {'item': number, 'rating': rating, 'reason': f'Stub judgment {rating}'}
+            for number, rating in enumerate(ratings, 1)
+        ]})
+    rating = stub_rating(prompt.split('\n', 1)[-1])
+    return json.dumps({'rating': rating, 'reason': f'Stub judgment {rating}'})
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serve canned chat completions; configuration lives on the server object."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON body'}})
+            return
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'Unknown path: {self.path}'}})
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        with self.server.lock:
+            self.server.request_count += 1
+            request_num = self.server.request_count
+
+        reply = judgment_reply(body) if self.server.judge else self.server.reply
+        choices = [
+            {
+                'index': i,
+                'message': {'role': 'assistant', 'content': reply},
+                'finish_reason': 'stop'
+            }
+            for i in range(int(body.get('n') or 1))
+        ]
+        self._send_json(200, {
+            'id': f'chatcmpl-stub-{request_num}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': choices,
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+        })
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded server with a listen backlog deep enough for hundreds of concurrent clients."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def create_server(host='127.0.0.1', port=8000, latency=0.0, reply=DEFAULT_REPLY, judge=False):
+    """Build a stub server; call serve_forever() on the result (or run it in a thread)."""
+    server = StubServer((host, port), StubHandler)
+    server.latency = latency
+    server.reply = reply
+    server.judge = judge
+    server.request_count = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub OpenAI-compatible chat completions server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before each reply')
+    parser.add_argument('--reply', default=DEFAULT_REPLY, help='Content returned for every completion')
+    parser.add_argument('--judge', action='store_true',
+                        help='Reply with {"rating": 1-4, "reason": ...} judgments instead of --reply')
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.latency, args.reply, args.judge)
+    print(f"Stub server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served {server.request_count} requests")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Compressed token-analysis sink for judge batches.
+
+Each batch writes token_analysis/batch_NNNN_tokens.jsonl.gz: a header line with the batch number, judge
+model and the hash of the judge prompt template, then one compact line per request with its QA ID,
+rating, token counts (including prompt-cache hits) and raw response text. The template is stored once
+per directory as prompt_{hash}.txt; questions and answers are already in the batch CSV. Summaries are
+computed from these files on demand.
+
+Usage:
+    python token_analysis.py <judge_run_dir> [<judge_run_dir> ...]
+"""
+
+import os
+import sys
+import gzip
+import json
+import hashlib
+from glob import glob
+from datetime import datetime
+
+
+def template_hash(prompt_template):
+    return hashlib.sha256(prompt_template.encode('utf-8')).hexdigest()[:16]
+
+
+class TokenAnalysisWriter:
+    """Append one batch's per-request token usage to a gzipped JSONL file."""
+
+    def __init__(self, output_dir, batch_num, judge_model, prompt_template):
+        analysis_dir = os.path.join(output_dir, "token_analysis")
+        os.makedirs(analysis_dir, exist_ok=True)
+
+        prompt_hash = template_hash(prompt_template)
+        template_file = os.path.join(analysis_dir, f"prompt_{prompt_hash}.txt")
+        if not os.path.exists(template_file):
+            with open(template_file, 'w', encoding='utf-8') as f:
+                f.write(prompt_template)
+
+        self.path = os.path.join(analysis_dir, f"batch_{batch_num:04d}_tokens.jsonl.gz")
+        self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self._write({
+            'batch_number': batch_num,
+            'timestamp': datetime.now().isoformat(),
+            'judge_model': judge_model,
+            'prompt_template': prompt_hash
+        })
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def add(self, qa_id, result):
+        self._write({
+            'qa_id': qa_id,
+            'rating': result.get('rating'),
+            'input_tokens': result.get('input_tokens', 0),
+            'cached_input_tokens': result.get('cached_input_tokens', 0),
+            'output_tokens': result.get('output_tokens', 0),
+            'response': result.get('text')
+        })
+
+    def close(self):
+        self.file.close()
+
+    def discard(self):
+        """Close and delete the file, e.g. when the batch's results could not be read completely."""
+        self.file.close()
+        os.remove(self.path)
+
+
+def read_token_analysis(output_dir):
+    """Yield (header, entries) for every batch file in a judge run directory."""
+    for path in sorted(glob(os.path.join(output_dir, "token_analysis", "batch_*_tokens.jsonl.gz"))):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            yield header, [json.loads(line) for line in f if line.strip()]
+
+
+def summarize_token_analysis(output_dir):
+    """Token usage totals and per-pair averages of a judge run, computed from its token-analysis files."""
+    num_pairs = 0
+    num_batches = 0
+    input_tokens = 0
+    cached_input_tokens = 0
+    output_tokens = 0
+    for _, entries in read_token_analysis(output_dir):
+        num_batches += 1
+        num_pairs += len(entries)
+        input_tokens += sum(entry['input_tokens'] for entry in entries)
+        cached_input_tokens += sum(entry.get('cached_input_tokens', 0) for entry in entries)
+        output_tokens += sum(entry['output_tokens'] for entry in entries)
+    total_tokens = input_tokens + output_tokens
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'total_qa_pairs': num_pairs,
+        'total_batches': num_batches,
+        'token_usage': {
+            'input_tokens': input_tokens,
+            'cached_input_tokens': cached_input_tokens,
+            'output_tokens': output_tokens,
+            'total_tokens': total_tokens
+        },
+        'average_per_qa': {
+            'input_tokens': round(input_tokens / num_pairs, 2) if num_pairs > 0 else 0,
+            'output_tokens': round(output_tokens / num_pairs, 2) if num_pairs > 0 else 0,
+            'total_tokens': round(total_tokens / num_pairs, 2) if num_pairs > 0 else 0
+        }
+    }
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python token_analysis.py <judge_run_dir> [<judge_run_dir> ...]")
+        sys.exit(1)
+
+    for output_dir in sys.argv[1:]:
+        print(f"{output_dir}:")
+        print(json.dumps(summarize_token_analysis(output_dir), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import json
+import os
+import sys
+
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "pipeline")
+sys.path.insert(0, PIPELINE_DIR)
+sys.path.insert(0, os.path.join(PIPELINE_DIR, "judges"))
+from judge_engine import (PackedJudge, listwise_requests, multi_item_request, pack_batches,  # noqa: E402
+                          request_items, request_prompt_template, split_multi_result, token_shares)
+from prompts import JUDGE_LISTWISE_PROMPT_TEMPLATE, JUDGE_MULTI_PROMPT_TEMPLATE, JUDGE_PROMPT_TEMPLATE  # noqa: E402
+
+
+def pair(qa_id, question="What is 2 + 2?", reference="4"):
+    return {"id": qa_id, "custom_id": f"model::{qa_id}", "question": question, "model_answer": f"answer {qa_id}",
+            "reference_answer": reference}
+
+
+def multi_reply(judgments, **tokens):
+    return dict({"text": json.dumps({"judgments": judgments})}, **tokens)
+
+
+def test_multi_item_request_ids_are_stable_and_tagged():
+    pairs = [pair("q1"), pair("q2")]
+
+    unit = multi_item_request(pairs)
+    listwise = multi_item_request(pairs, listwise=True)
+
+    assert unit["custom_id"].startswith("multi_") and "listwise" not in unit
+    assert listwise["custom_id"].startswith("list_") and listwise["listwise"]
+    assert unit["custom_id"] == multi_item_request([pair("q1"), pair("q2")])["custom_id"]
+    assert unit["custom_id"] != multi_item_request(pairs[::-1])["custom_id"]
+    assert unit["custom_id"][len("multi_"):] == listwise["custom_id"][len("list_"):]
+
+
+def test_listwise_requests_group_by_question_and_split_evenly():
+    pairs = [pair(f"a{i}", question="Q1") for i in range(20)] + [pair("b0", question="Q2")]
+
+    units = listwise_requests(pairs, max_answers=16)
+
+    assert [len(request_items(unit)) for unit in units] == [10, 10, 1]
+    assert all(unit["listwise"] for unit in units[:2])
+    assert units[2] is pairs[-1]
+    assert {qa["question"] for unit in units[:2] for qa in unit["items"]} == {"Q1"}
+    assert sorted(qa["id"] for unit in units[:2] for qa in unit["items"]) == sorted(f"a{i}" for i in range(20))
+
+
+def test_listwise_requests_shuffle_is_deterministic():
+    first = listwise_requests([pair(f"a{i}") for i in range(8)], max_answers=16)
+    second = listwise_requests([pair(f"a{i}") for i in range(8)], max_answers=16)
+
+    assert [qa["id"] for qa in first[0]["items"]] == [qa["id"] for qa in second[0]["items"]]
+    assert first[0]["custom_id"] == second[0]["custom_id"]
+
+
+def test_request_items_skips_pairs_no_longer_pending():
+    single = pair("q1")
+    unit = {"custom_id": "multi_x", "items": [pair("q2"), None, pair("q3")]}
+
+    assert request_items(single) == [single]
+    assert [qa["id"] for qa in request_items(unit)] == ["q2", "q3"]
+
+
+def test_token_shares_add_up_to_the_request():
+    unit = multi_item_request([pair("q1"), pair("q2"), pair("q3")])
+
+    shares = token_shares(unit, {"input_tokens": 100, "cached_input_tokens": 10, "output_tokens": 8})
+
+    for key, total in (("input_tokens", 100), ("cached_input_tokens", 10), ("output_tokens", 8)):
+        assert sum(share[key] for share in shares.values()) == total
+    assert shares["model::q1"]["input_tokens"] == 34 and shares["model::q3"]["input_tokens"] == 33
+
+
+def test_request_prompt_template():
+    pairs = [pair("q1"), pair("q2")]
+
+    assert request_prompt_template(pairs[0]) == JUDGE_PROMPT_TEMPLATE
+    assert request_prompt_template(multi_item_request(pairs)) == JUDGE_MULTI_PROMPT_TEMPLATE
+    assert request_prompt_template(multi_item_request(pairs, listwise=True)) == JUDGE_LISTWISE_PROMPT_TEMPLATE
+
+
+def test_split_multi_result_leaves_out_malformed_items():
+    unit = multi_item_request([pair("q1"), pair("q2"), pair("q3"), pair("q4")])
+    result = multi_reply([
+        {"item": 1, "rating": 3, "reason": "ok"},
+        {"item": 2, "rating": 7, "reason": "out of range"},
+        {"item": 4, "rating": 1, "reason": "first"},
+        {"item": 4, "rating": 2, "reason": "duplicate"},
+    ], input_tokens=40, output_tokens=4)
+
+    split = split_multi_result(unit, result)
+
+    assert list(split) == ["model::q1"]
+    assert split["model::q1"]["rating"] == 3
+    assert split["model::q1"]["input_tokens"] == 10 and split["model::q1"]["output_tokens"] == 1
+
+
+@pytest.mark.parametrize("text", ["", "not json", '{"rating": 3}', '{"judgments": "none"}'])
+def test_split_multi_result_of_unparseable_reply_is_empty(text):
+    unit = multi_item_request([pair("q1"), pair("q2")])
+
+    assert split_multi_result(unit, {"text": text}) == {}
+
+
+def test_split_multi_result_keeps_item_numbers_of_reattached_units():
+    unit = {"custom_id": "multi_x", "items": [None, pair("q2")]}
+    result = multi_reply([{"item": 1, "rating": 4, "reason": "gone"}, {"item": 2, "rating": 2, "reason": "kept"}])
+
+    assert {custom_id: judged["rating"] for custom_id, judged in split_multi_result(unit, result).items()} == \
+        {"model::q2": 2}
+
+
+def test_pack_batches_respects_request_and_byte_limits():
+    pairs = [pair(f"q{i}") for i in range(7)]
+    sizes = {"q3": 50}
+
+    batches = pack_batches(pairs, lambda qa: sizes.get(qa["id"], 10), max_requests=3, max_bytes=55)
+
+    assert [[qa["id"] for qa in batch] for batch in batches] == [["q0", "q1", "q2"], ["q3"], ["q4", "q5", "q6"]]
+    assert pack_batches([], lambda qa: 1, 3, 55) == []
+
+
+def test_reattached_units_restore_multi_item_and_listwise_requests():
+    pairs = [pair("q1"), pair("q2"), pair("q3"), pair("q4"), pair("q5")]
+    multi = multi_item_request(pairs[:2])
+    listwise = multi_item_request(pairs[2:4], listwise=True)
+    job = {"units": {multi["custom_id"]: ["model::q1", "model::q2"],
+                     listwise["custom_id"]: ["model::q3", "model::q4"],
+                     "multi_judged": ["model::q0"]}}
+
+    # q1 was judged since the job was submitted; q0's request has no pending pair left.
+    units = PackedJudge.reattached_units(pairs[1:], job)
+
+    assert [unit["custom_id"] for unit in units] == [multi["custom_id"], listwise["custom_id"], "model::q5"]
+    assert units[0]["items"][0] is None and "listwise" not in units[0]
+    assert units[1]["listwise"]
+    assert request_prompt_template(units[1]) == JUDGE_LISTWISE_PROMPT_TEMPLATE
+    assert PackedJudge.reattached_units(pairs, {}) == pairs
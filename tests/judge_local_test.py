@@ -0,0 +1,139 @@
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "pipeline")
+sys.path.insert(0, PIPELINE_DIR)
+sys.path.insert(0, os.path.join(PIPELINE_DIR, "judges"))
+sys.path.insert(0, os.path.join(PIPELINE_DIR, "evaluation"))
+import judge_engine  # noqa: E402
+import judge_local  # noqa: E402
+import merge_judge  # noqa: E402
+import run_evaluation  # noqa: E402
+import stub_server  # noqa: E402
+from judge_local import LocalBackend  # noqa: E402
+from stub_server import create_server, judgment_reply  # noqa: E402
+
+FIELDNAMES = ["QA_Pair_ID", "Question", "Model Answer", "Reference Answer", "QA Type"]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = create_server(port=0, judge=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(judge_local, "BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run from three levels below tmp_path, so the judges' ../../../output and ../../../logs land in it."""
+    for script_dir in ("judges", "evaluation"):
+        (tmp_path / "scripts" / "pipeline" / script_dir).mkdir(parents=True)
+    (tmp_path / "output").mkdir()
+    monkeypatch.chdir(tmp_path / "scripts" / "pipeline" / "judges")
+    monkeypatch.setattr(judge_engine, "install_shutdown_handlers", lambda: None)
+    return tmp_path
+
+
+def write_csv(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+def make_rows(answer_prefix, count=7):
+    return [{"QA_Pair_ID": f"q{i}", "Question": f"What is {i} + 1?", "Model Answer": f"{answer_prefix} {chr(97 + i)}",
+             "Reference Answer": str(i + 1), "QA Type": "teacher"} for i in range(count)]
+
+
+def expected_ratings(rows):
+    """The rating the stub gives each pair when it is judged alone."""
+    backend = LocalBackend("EMPTY", "test", logging.getLogger(__name__))
+    ratings = {}
+    for row in rows:
+        qa = {"custom_id": row["QA_Pair_ID"], "question": row["Question"], "model_answer": row["Model Answer"],
+              "reference_answer": row["Reference Answer"]}
+        ratings[row["QA_Pair_ID"]] = json.loads(judgment_reply(backend.build_request(qa)["body"]))["rating"]
+    return ratings
+
+
+def judged_ratings(workdir, model):
+    results, _ = merge_judge.load_judge_results_from_batches(str(workdir / "output" / "local_judge" / model))
+    return {qa_id: int(float(result["rating"])) for qa_id, result in results.items()}
+
+
+def test_judge_merge_and_evaluate_against_stub(stub, workdir, monkeypatch, capsys):
+    rows = make_rows("guess")
+    rows[0]["Model Answer"] = rows[0]["Reference Answer"]
+    csv_path = write_csv(workdir / "output" / "model.csv", rows)
+
+    judge_engine.run_judges([LocalBackend], [csv_path])
+
+    expected = expected_ratings(rows[1:])
+    expected["q0"] = 4
+    assert judged_ratings(workdir, "model") == expected
+    assert stub.request_count == len(rows) - 1
+
+    monkeypatch.chdir(workdir / "scripts" / "pipeline")
+    monkeypatch.setattr(sys, "argv", ["merge_judge.py", csv_path, "local"])
+    merge_judge.main()
+    with open(csv_path, encoding="utf-8", newline="") as f:
+        merged = {row["QA_Pair_ID"]: int(float(row["Local_Judge_Rating"])) for row in csv.DictReader(f)}
+    assert merged == expected
+
+    monkeypatch.chdir(workdir / "scripts" / "pipeline" / "evaluation")
+    monkeypatch.setattr(sys, "argv", ["run_evaluation.py", csv_path, "--skip-ensemble", "--skip-samples"])
+    capsys.readouterr()
+    run_evaluation.main()
+    correct = sum(1 for rating in expected.values() if rating >= 3)
+    assert f"Binarized Accuracy: {correct / len(rows):.1%} (N={len(rows)})" in capsys.readouterr().out
+
+    # Everything is judged, so a rerun sends nothing.
+    monkeypatch.chdir(workdir / "scripts" / "pipeline" / "judges")
+    judge_engine.run_judges([LocalBackend], [csv_path])
+    assert stub.request_count == len(rows) - 1
+
+
+def test_items_per_request_falls_back_for_malformed_item(stub, workdir, monkeypatch):
+    def drop_second_item(body):
+        reply = json.loads(judgment_reply(body))
+        if "judgments" in reply:
+            reply["judgments"] = [judgment for judgment in reply["judgments"] if judgment["item"] != 2]
+        return json.dumps(reply)
+
+    monkeypatch.setattr(stub_server, "judgment_reply", drop_second_item)
+    monkeypatch.setattr(judge_engine, "ITEMS_PER_REQUEST", 3)
+    rows = make_rows("guess")
+    csv_path = write_csv(workdir / "output" / "model.csv", rows)
+
+    judge_engine.run_judges([LocalBackend], [csv_path])
+
+    # 7 pairs go out as requests of 3, 3 and 1; the second item of both multi-item requests is re-judged alone.
+    assert judged_ratings(workdir, "model") == expected_ratings(rows)
+    assert stub.request_count == 5
+
+
+def test_listwise_round_trip(stub, workdir, monkeypatch):
+    monkeypatch.setattr(judge_engine, "LISTWISE", True)
+    first_rows = make_rows("guess", count=4)
+    second_rows = make_rows("maybe", count=4)
+    input_files = [write_csv(workdir / "output" / "first.csv", first_rows),
+                   write_csv(workdir / "output" / "second.csv", second_rows)]
+
+    judge_engine.run_judges([LocalBackend], input_files)
+
+    # Both models' answers to a question share one listwise request and get their single-item ratings.
+    assert stub.request_count == len(first_rows)
+    assert judged_ratings(workdir, "first") == expected_ratings(first_rows)
+    assert judged_ratings(workdir, "second") == expected_ratings(second_rows)
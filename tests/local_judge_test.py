@@ -0,0 +1,66 @@
+import os
+import sys
+from fractions import Fraction
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "pipeline"))
+from local_judge import answers_equivalent, local_judgments, normalize_answer, parse_number  # noqa: E402
+
+
+@pytest.mark.parametrize("reference, answer", [
+    ("3/4", "0.75"),
+    ("1/2", "2/4"),
+    ("1 1/2", "1.5"),
+    ("1 1/2", "3/2"),
+    ("-1 1/2", "-1.5"),
+    ("1,000", "1000"),
+    ("12 cm", "12"),
+    ("12 cm", "12 cm."),
+    ("90 degrees", "90"),
+    ("x = 3", "x=3"),
+    ("3x + 2 = 8", "$3x+2=8$"),
+    ("five", "five."),
+])
+def test_equivalent(reference, answer):
+    assert answers_equivalent(reference, answer)
+
+
+@pytest.mark.parametrize("reference, answer", [
+    ("1 1/2", "11/2"),      # 1.5 vs 5.5
+    ("3 4", "34"),
+    ("1 2", "12"),
+    ("2 1/4", "21/4"),
+    ("12 cm", "12 m"),
+    ("3 apples", "3"),
+    ("0.33", "1/3"),
+    ("x = 3", "x = 4"),
+    ("X = 3", "x = 3"),
+    ("12 cm", "12 CM"),
+    ("", ""),
+])
+def test_not_equivalent(reference, answer):
+    assert not answers_equivalent(reference, answer)
+
+
+def test_parse_number():
+    assert parse_number("1 1/2") == (Fraction(3, 2), None)
+    assert parse_number("-3/4") == (Fraction(-3, 4), None)
+    assert parse_number("12 cm") == (Fraction(12), "cm")
+    assert parse_number("3 apples") is None
+    assert parse_number("3 4") is None
+    assert parse_number("1/0") is None
+
+
+def test_normalize_answer():
+    assert normalize_answer("  $3 × 4$. ") == "3 * 4"
+    assert normalize_answer("A   B!") == "A B"
+
+
+def test_local_judgments():
+    qa_pairs = [
+        {'id': 'a', 'reference_answer': '1 1/2', 'model_answer': '1.5'},
+        {'id': 'b', 'reference_answer': '1 1/2', 'model_answer': '11/2'},
+    ]
+    assert list(local_judgments(qa_pairs)) == ['a']
+    assert local_judgments(qa_pairs)['a']['rating'] == 4
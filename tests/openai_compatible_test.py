@@ -0,0 +1,71 @@
+import csv
+import logging
+import os
+import sys
+import threading
+
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "pipeline")
+sys.path.insert(0, PIPELINE_DIR)
+sys.path.insert(0, os.path.join(PIPELINE_DIR, "generation"))
+import generate_openai_compatible as generation  # noqa: E402
+from stub_server import DEFAULT_REPLY, create_server  # noqa: E402
+
+
+@pytest.fixture
+def stub_url():
+    server = create_server(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(generation, "IMAGE_FOLDER", str(tmp_path))
+    (tmp_path / "q.jpg").write_bytes(b"\xff\xd8\xff\xd9")
+    return [{"QA_Pair_ID": f"q{i}", "Question": f"What is {i} + 1?", "Image Name": "q.jpg"} for i in range(7)]
+
+
+def read_output(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.mark.parametrize("num_samples", [1, 3])
+def test_run_generation_against_stub(stub_url, rows, tmp_path, num_samples):
+    server, base_url = stub_url
+    output_csv = tmp_path / "model.csv"
+    client = generation.create_pooled_client(base_url, "EMPTY", 4)
+    answered = []
+
+    generation.run_generation(rows, client, "stub", str(output_csv), 4, num_samples, logging.getLogger(__name__),
+                              on_answer=lambda row: answered.append(row["QA_Pair_ID"]))
+
+    written = read_output(output_csv)
+    columns = generation.answer_columns(num_samples)
+    assert [row["QA_Pair_ID"] for row in written] == [row["QA_Pair_ID"] for row in rows]
+    assert all(row[column] == DEFAULT_REPLY for row in written for column in columns)
+    assert sorted(answered) == sorted(row["QA_Pair_ID"] for row in rows)
+    assert server.request_count == len(rows)
+
+
+def test_run_generation_only_fills_missing_answers(stub_url, rows, tmp_path):
+    server, base_url = stub_url
+    output_csv = tmp_path / "model.csv"
+    for row in rows:
+        row["Model Answer"] = "kept"
+        row["Model Answer Sample 2"] = "kept" if row["QA_Pair_ID"] != "q3" else ""
+    client = generation.create_pooled_client(base_url, "EMPTY", 4)
+
+    generation.run_generation(rows, client, "stub", str(output_csv), 4, 2, logging.getLogger(__name__))
+
+    written = {row["QA_Pair_ID"]: row for row in read_output(output_csv)}
+    assert len(written) == len(rows)
+    assert written["q3"]["Model Answer"] == "kept"
+    assert written["q3"]["Model Answer Sample 2"] == DEFAULT_REPLY
+    assert all(row["Model Answer Sample 2"] == "kept" for qa_id, row in written.items() if qa_id != "q3")
+    assert server.request_count == 1
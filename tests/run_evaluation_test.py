@@ -0,0 +1,35 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "pipeline")
+sys.path.insert(0, PIPELINE_DIR)
+sys.path.insert(0, os.path.join(PIPELINE_DIR, "evaluation"))
+from run_evaluation import compute_accuracy, majority_vote, pass_at_k  # noqa: E402
+
+
+@pytest.mark.parametrize("ratings, expected", [
+    ([3, 3, 1], 3),
+    (["4", "2", "4.0"], 4),
+    ([1, 4], 1),                # ties go to the lower rating
+    ([2, 3, -1, "", "-1"], 2),  # failed judgments are not votes
+    ([-1, "", "-1"], -1),
+    ([], -1),
+])
+def test_majority_vote(ratings, expected):
+    assert majority_vote(ratings) == expected
+
+
+def test_pass_at_k():
+    num_correct = np.array([0, 1, 2, 4])
+
+    assert pass_at_k(num_correct, 4, 1).tolist() == pytest.approx([0.0, 0.25, 0.5, 1.0])
+    assert pass_at_k(num_correct, 4, 2).tolist() == pytest.approx([0.0, 0.5, 5 / 6, 1.0])
+    assert pass_at_k(num_correct, 4, 4).tolist() == pytest.approx([0.0, 1.0, 1.0, 1.0])
+
+
+def test_compute_accuracy_ignores_failed_judgments():
+    assert compute_accuracy([1, "2", 3, "4", -1, ""]) == (0.5, 4)
+    assert compute_accuracy(["-1"]) == (0.0, 0)
@@ -0,0 +1,51 @@
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "pipeline"))
+from shared_utils import BatchLedger, is_valid_rating, reattach_batches  # noqa: E402
+
+LOGGER = logging.getLogger(__name__)
+
+
+def pair(qa_id, answer="4"):
+    return {"id": qa_id, "question": f"Question {qa_id}", "model_answer": answer, "reference_answer": "4"}
+
+
+def test_ledgers_sharing_a_file_merge_their_entries(tmp_path):
+    path = str(tmp_path / "judge" / "batch_ledger.json")
+    first = BatchLedger(path, "openai", "gpt-4o")
+    second = BatchLedger(path, "openai", "gpt-4o")
+
+    first.record("job_a", 1, [pair("q1")], "run_a")
+    second.record("job_b", 1, [pair("q2")], "run_b")
+    first.update("job_a", "collected")
+
+    on_disk = {entry["job_id"]: entry["status"] for entry in BatchLedger(path, "openai", "gpt-4o").entries}
+    assert on_disk == {"job_a": "collected", "job_b": "submitted"}
+    assert [entry["job_id"] for entry in BatchLedger(path, "openai", "gpt-4o").unfinished()] == ["job_b"]
+    assert BatchLedger(path, "gemini", "gemini-2.5-pro").unfinished() == []
+
+
+def test_reattach_batches(tmp_path):
+    ledger = BatchLedger(str(tmp_path / "batch_ledger.json"), "openai", "gpt-4o")
+    ledger.record("job_unchanged", 1, [pair("q1"), pair("q2")], "run", units={"multi_x": ["m::q1", "m::q2"]})
+    ledger.record("job_changed", 2, [pair("q3")], "run")
+    ledger.record("job_judged", 3, [pair("q4")], "run")
+    ledger.record("job_other_file", 4, [pair("z1")], "run")
+    qa_pairs = [pair("q1"), pair("q2"), pair("q3", answer="5"), pair("q5")]
+
+    reattached, remaining = reattach_batches(ledger, qa_pairs, {"q4"}, LOGGER)
+
+    assert [(([qa["id"] for qa in batch_pairs]), job["id"]) for batch_pairs, job in reattached] == \
+        [(["q1", "q2"], "job_unchanged")]
+    assert reattached[0][1]["units"] == {"multi_x": ["m::q1", "m::q2"]}
+    assert [qa["id"] for qa in remaining] == ["q3", "q5"]
+    statuses = {entry["job_id"]: entry["status"] for entry in ledger.entries}
+    assert statuses == {"job_unchanged": "submitted", "job_changed": "stale", "job_judged": "superseded",
+                        "job_other_file": "submitted"}
+
+
+def test_is_valid_rating():
+    assert all(is_valid_rating(rating) for rating in (1, 4, "3", " 2.0 "))
+    assert not any(is_valid_rating(rating) for rating in (-1, "-1", "", None, 5, "n/a"))